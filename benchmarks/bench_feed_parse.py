@@ -0,0 +1,73 @@
+"""
+Benchmark of the affiliate feed parsers on the sample feeds.
+
+Compares the compiled, index based FeedParser with reading the same columns from
+csv.DictReader rows with row.get(), the way the parsers worked before.
+
+Usage, from the project root:
+    python benchmarks/bench_feed_parse.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spelvinden_datafeeder.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from games.management.commands.affiliate_command_base import (  # noqa: E402
+    AFFILIATE_PARSERS, ParsedGameData, get_csv_reader, get_csv_rows,
+)
+from games.models import Affiliate  # noqa: E402
+
+# Sample feeds and the program they are in
+SAMPLE_FEEDS = {
+    '999 Games': Affiliate.Program.DAISYCON,
+    'Bruna': Affiliate.Program.ADTRACTION,
+    'Degrotespeelgoedwinkel': Affiliate.Program.TRADETRACKER,
+    'Spelspul': Affiliate.Program.ADTRACTION,
+    'Valhallaboardgames': Affiliate.Program.DAISYCON,
+}
+
+ROUNDS = 5
+
+
+def parse_dict_rows(parser, lines):
+    """
+    Reads the columns of the parser from DictReader rows, like the parsers did before.
+    """
+    columns = [parser.columns[field] for field in ParsedGameData._fields]
+    parsed_data = []
+    for row in get_csv_reader(lines):
+        values = []
+        for column in columns:
+            value = next((row.get(name) for name in column.names if row.get(name)), '') or ''
+            values.append(column.cast(value) if column.cast else value)
+        if values[0]:
+            parsed_data.append(ParsedGameData(*values))
+    return parsed_data
+
+
+def main():
+    total_dict = total_compiled = 0
+    for name, program in SAMPLE_FEEDS.items():
+        path = os.path.join('games', 'sample_data', f'{name}.csv')
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        parser = AFFILIATE_PARSERS[program]
+
+        dict_time = timeit.timeit(lambda: parse_dict_rows(parser, lines), number=ROUNDS) / ROUNDS
+        compiled_time = timeit.timeit(lambda: parser.parse_rows(get_csv_rows(lines)), number=ROUNDS) / ROUNDS
+        total_dict += dict_time
+        total_compiled += compiled_time
+        print(f"{name:24} {len(lines):6} lines  DictReader {dict_time * 1000:7.1f} ms  "
+              f"compiled {compiled_time * 1000:7.1f} ms")
+
+    print(f"{'Total':32}  DictReader {total_dict * 1000:7.1f} ms  compiled {total_compiled * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of reading a big local feed file.
+
+Builds a feed of a few hundred MB out of a sample feed and compares reading it with
+f.read().splitlines(), the way local feeds were read before, with the memory mapped reader
+in affiliate_feed_reader. Reports the time to read and parse all rows and the peak memory
+allocated by Python while doing so.
+
+Usage, from the project root:
+    python benchmarks/bench_feed_read.py
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from games.management.commands.affiliate_feed_reader import (  # noqa: E402
+    iter_feed_lines, map_feed_file, sniff_feed_delimiter,
+)
+
+SAMPLE_FEED = os.path.join('games', 'sample_data', 'Spelspul.csv')
+
+# Number of times the rows of the sample feed are repeated
+REPEAT = 50
+
+
+def build_feed(path):
+    with open(SAMPLE_FEED, 'rb') as f:
+        header, rows = f.read().split(b'\n', 1)
+    with open(path, 'wb') as f:
+        f.write(header + b'\n')
+        for _ in range(REPEAT):
+            f.write(rows)
+
+
+def read_splitlines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    delimiter = csv.Sniffer().sniff("\n".join(lines[:10])).delimiter
+    return sum(1 for _ in csv.reader(lines, delimiter=delimiter))
+
+
+def read_mapped(path):
+    content = map_feed_file(path)
+    delimiter = sniff_feed_delimiter(content)
+    return sum(1 for _ in csv.reader(iter_feed_lines(content), delimiter=delimiter))
+
+
+def measure(read, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = read(path)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, duration, peak
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'feed.csv')
+        build_feed(path)
+        print(f"Feed of {os.path.getsize(path) / 2 ** 20:.0f} MB")
+
+        for name, read in (('read().splitlines()', read_splitlines), ('mmap', read_mapped)):
+            rows, duration, peak = measure(read, path)
+            print(f"{name:20} {rows:8} rows  {duration:6.2f} s  peak memory {peak / 2 ** 20:7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Import time profile of the project startup, using python -X importtime.
+
+Measures what a management command or WSGI worker pays before doing any work: Django setup,
+the URL configuration and the command modules. Checks that the heavy optional dependencies
+(BeautifulSoup and requests) are not imported at startup anymore, and compares the startup
+time with importing them eagerly, the way the models and commands did before.
+
+Usage, from the project root:
+    python benchmarks/bench_import_time.py
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by every command, the admin's WSGI workers and the feed commands
+STARTUP_MODULES = [
+    'spelvinden_datafeeder.urls',
+    'games.admin',
+    'games.management.commands.update_prices',
+    'games.management.commands.import_affiliate_categories',
+    'games.management.commands.create_wordpress_import_csv',
+    'games.management.commands.sync_worker',
+]
+
+# Dependencies that should only be imported when they are used
+LAZY_MODULES = ['bs4', 'requests']
+
+ROUNDS = 7
+
+# Number of slowest modules to show
+TOP_MODULES = 15
+
+STARTUP_SCRIPT = """
+import os, sys
+sys.path.insert(0, {project_dir!r})
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spelvinden_datafeeder.settings')
+{eager_imports}
+import django
+django.setup()
+{imports}
+print(','.join(name for name in {lazy_modules!r} if name in sys.modules))
+"""
+
+
+def run_startup(eager=False):
+    """
+    Imports the startup modules in a fresh interpreter. Returns the -X importtime report as a list of
+    (module, self us, cumulative us, nesting depth) and the lazy modules that were imported.
+    """
+    script = STARTUP_SCRIPT.format(
+        project_dir=PROJECT_DIR,
+        eager_imports='\n'.join(f'import {name}' for name in LAZY_MODULES) if eager else '',
+        imports='\n'.join(f'import {name}' for name in STARTUP_MODULES),
+        lazy_modules=LAZY_MODULES,
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True,
+    )
+
+    report = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        report.append((name.strip(), int(self_time), int(cumulative_time), depth))
+    imported_lazy_modules = [name for name in result.stdout.strip().split(',') if name]
+    return report, imported_lazy_modules
+
+
+def total_import_time(report):
+    # The cumulative times of the top level imports add up to the total
+    return sum(cumulative for _, _, cumulative, depth in report if depth == 0)
+
+
+def measure(eager):
+    totals = []
+    for _ in range(ROUNDS):
+        report, imported_lazy_modules = run_startup(eager)
+        totals.append(total_import_time(report))
+    return statistics.median(totals) / 1000, report, imported_lazy_modules
+
+
+def main():
+    lazy_time, report, imported_lazy_modules = measure(eager=False)
+    eager_time, _, _ = measure(eager=True)
+
+    print(f"Slowest modules at startup (cumulative, last of {ROUNDS} rounds):")
+    slowest = sorted(report, key=lambda item: item[2], reverse=True)[:TOP_MODULES]
+    for name, self_time, cumulative_time, _ in slowest:
+        print(f"  {cumulative_time / 1000:7.1f} ms  {self_time / 1000:7.1f} ms self  {name}")
+
+    print()
+    if imported_lazy_modules:
+        print(f"Imported at startup, should be lazy: {', '.join(imported_lazy_modules)}")
+    else:
+        print(f"Not imported at startup: {', '.join(LAZY_MODULES)}")
+    print(f"Startup imports (median of {ROUNDS}): lazy {lazy_time:.1f} ms, "
+          f"eager {eager_time:.1f} ms, saved {eager_time - lazy_time:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark of the Dutch price formatting used by the WordPress export.
+
+Compares games.formatting.format_price with the locale based formatting that was used
+before and checks that both give byte-identical output, including prices with thousands
+grouping. The locale comparison is skipped when the nl_NL.UTF-8 locale isn't installed.
+
+Usage, from the project root:
+    python benchmarks/bench_price_format.py
+"""
+import locale
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from games.formatting import format_price  # noqa: E402
+
+NUMBER_OF_PRICES = 100_000
+
+
+def locale_format_price(price):
+    # The formatting the export used before, with the nl_NL locale set
+    return locale.currency(price, symbol=False, grouping=True).replace(' ', '')
+
+
+def main():
+    random.seed(42)
+    # Prices as they come from a DecimalField(max_digits=6, decimal_places=2), a third is 1000 or more
+    prices = [Decimal(random.randint(0, 999_999)).scaleb(-2) for _ in range(NUMBER_OF_PRICES)]
+
+    duration = timeit.timeit(lambda: [format_price(price) for price in prices], number=5) / 5
+    print(f"format_price:        {duration * 1000:8.1f} ms for {NUMBER_OF_PRICES} prices")
+
+    try:
+        locale.setlocale(locale.LC_ALL, 'nl_NL.UTF-8')
+    except locale.Error:
+        print("SKIPPED: the nl_NL.UTF-8 locale is not installed, format_price was not compared with "
+              "locale.currency and the locale path was not timed")
+        return
+
+    duration = timeit.timeit(lambda: [locale_format_price(price) for price in prices], number=5) / 5
+    print(f"locale.currency:     {duration * 1000:8.1f} ms for {NUMBER_OF_PRICES} prices")
+
+    mismatches = [price for price in prices if format_price(price) != locale_format_price(price)]
+    if mismatches:
+        print(f"{len(mismatches)} prices are formatted differently, e.g. {mismatches[0]}: "
+              f"{format_price(mismatches[0])!r} != {locale_format_price(mismatches[0])!r}")
+        sys.exit(1)
+    print(f"Output is identical for all {NUMBER_OF_PRICES} prices")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Fuzz test and benchmark of the price parser used by the affiliate feed parsers.
+
+Checks that games.pricing parses randomly generated prices in all formats seen in the
+feeds to the exact amount, including prices with three decimals, and compares its throughput with the float() based parsing
+that was used before.
+
+Usage, from the project root:
+    python benchmarks/bench_price_parse.py
+"""
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from games.pricing import parse_price, parse_price_cents, parse_prices  # noqa: E402
+
+NUMBER_OF_PRICES = 100_000
+
+
+def group_thousands(units, separator):
+    digits = str(units)
+    groups = []
+    while len(digits) > 3:
+        groups.insert(0, digits[-3:])
+        digits = digits[:-3]
+    groups.insert(0, digits)
+    return separator.join(groups)
+
+
+def format_variants(cents):
+    """
+    Returns the ways the feeds write an amount of cents, as (value, decimal separators) tuples.
+    The separators are None for values the parser has to derive them from.
+    """
+    units, fraction = divmod(cents, 100)
+    variants = [
+        (f"{units}.{fraction:02d}", '.'),
+        (f"{units}.{fraction:02d}0", '.'),
+        (f"{units}.{fraction:02d}", None),
+        (f"{units},{fraction:02d}", ','),
+        (f"{units},{fraction:02d}0", ','),
+        (f"{units},{fraction:02d} EUR", None),
+        (f"€ {units}.{fraction:02d}", '.'),
+        (f"{units}.{fraction:02d}", '.,'),
+        (f"{units},{fraction:02d}", '.,'),
+        (f"{group_thousands(units, '.')},{fraction:02d}", None),
+        (f"{group_thousands(units, ',')}.{fraction:02d}", None),
+    ]
+    if fraction == 0:
+        variants.append((str(units), None))
+    elif fraction % 10 == 0:
+        variants.append((f"{units}.{fraction // 10}", '.'))
+    return variants
+
+
+def fuzz(amounts):
+    failures = 0
+    for cents in amounts:
+        for value, separators in format_variants(cents):
+            if parse_price_cents(value, separators) != cents or parse_price(value, separators) != Decimal(cents) / 100:
+                failures += 1
+                if failures <= 10:
+                    print(f"Mismatch for {value!r}: {parse_price_cents(value, separators)} != {cents}")
+
+        # Three decimals are ambiguous without a declared separator
+        value = f"{cents // 100}.{cents % 100:02d}0"
+        try:
+            parse_price_cents(value)
+        except ValueError:
+            pass
+        else:
+            failures += 1
+            if failures <= 10:
+                print(f"No error for the ambiguous {value!r}")
+    return failures
+
+
+def float_parse(value):
+    # The parsing used by the feed parsers before
+    return Decimal(float((value or '0').replace(',', '.'))).quantize(Decimal('0.01'))
+
+
+def main():
+    random.seed(42)
+    amounts = [random.choice([random.randint(0, 9_999), random.randint(0, 999_999), random.randint(0, 10) * 100])
+               for _ in range(NUMBER_OF_PRICES)]
+
+    failures = fuzz(amounts)
+    print(f"Fuzz test: {failures} mismatches for {NUMBER_OF_PRICES} amounts in {len(format_variants(0))}+ formats")
+
+    # Typical feed column: dot decimals with a lot of repeated prices
+    values = [f"{cents // 100}.{cents % 100:02d}" for cents in
+              (random.choice([random.randint(100, 9_999), random.randint(1, 99) * 100 - 1]) for _ in range(NUMBER_OF_PRICES))]
+
+    def parse_uncached():
+        parse_price_cents.cache_clear()
+        return [parse_price(value, '.') for value in values]
+
+    for name, function in [
+        ('float() + Decimal', lambda: [float_parse(value) for value in values]),
+        ('parse_price (no cache)', parse_uncached),
+        ('parse_price', lambda: [parse_price(value, '.') for value in values]),
+        ('parse_prices', lambda: parse_prices(values, '.')),
+    ]:
+        duration = timeit.timeit(function, number=5) / 5
+        print(f"{name:24} {duration * 1000:8.1f} ms for {NUMBER_OF_PRICES} prices")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,13 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
 
-from .models import Game, Affiliate, AffiliateCategory, AffiliateGame
+from .models import (
+    Game, Affiliate, AffiliateCategory, AffiliateGame, AffiliateSyncStat, GamePriceStats, SyncBatch, SyncJob, SyncRun,
+)
+
+# Number of syncs shown in the trend charts
+TREND_SYNCS = 30
 
 
 @admin.register(Game)
@@ -48,6 +55,105 @@ class AffiliateCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(AffiliateGame)
 class AffiliateGameAdmin(admin.ModelAdmin):
-    list_display = ('game', 'affiliate', 'price', 'stock', 'category')
+    list_display = ('game', 'affiliate', 'price', 'effective_price_nl', 'effective_price_be', 'stock', 'category')
     search_fields = ('game__name', 'game__ean', 'category__name')
     list_filter = ('affiliate',)
+    # Computed from the price and the shipping costs of the affiliate when the offer is saved
+    readonly_fields = ('effective_price_nl', 'effective_price_be')
+
+
+@admin.register(GamePriceStats)
+class GamePriceStatsAdmin(admin.ModelAdmin):
+    list_display = ('game', 'offer_count', 'lowest_price', 'median_price', 'highest_price', 'discount', 'is_deal', 'is_price_drop', 'updated_at')
+    search_fields = ('game__name', 'game__ean')
+    list_filter = ('is_deal', 'is_price_drop')
+    ordering = ('-discount',)
+
+
+class SyncJobInline(admin.TabularInline):
+    model = SyncJob
+    fields = ('affiliate', 'status', 'attempts', 'lease_owner', 'started_at', 'finished_at', 'created_count', 'updated_count', 'last_error')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(SyncBatch)
+class SyncBatchAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'created_at', 'use_sample_data', 'exported_at')
+    inlines = [SyncJobInline]
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ('affiliate', 'batch', 'status', 'attempts', 'lease_owner', 'heartbeat_at', 'finished_at')
+    list_filter = ('status', 'affiliate')
+
+
+class AffiliateSyncStatInline(admin.TabularInline):
+    model = AffiliateSyncStat
+    fields = ('affiliate', 'bytes_downloaded', 'rows_scanned', 'rows_matched', 'rows_created', 'rows_changed',
+              'rows_unchanged', 'rows_expired', 'from_cache', 'download_seconds', 'parse_seconds', 'write_seconds', 'error')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'command', 'use_sample_data', 'started_at', 'finished_at', 'duration')
+    list_filter = ('command',)
+    inlines = [AffiliateSyncStatInline]
+
+
+def sparkline(values, width=240, height=40):
+    """
+    Returns the points of an SVG polyline for the values, scaled to the width and height.
+    """
+    if not values:
+        return ''
+    highest = max(values) or 1
+    step = width / (len(values) - 1) if len(values) > 1 else 0
+    return ' '.join(f"{index * step:.1f},{height - value / highest * height:.1f}" for index, value in enumerate(values))
+
+
+@admin.register(AffiliateSyncStat)
+class AffiliateSyncStatAdmin(admin.ModelAdmin):
+    list_display = ('affiliate', 'run', 'created_at', 'bytes_downloaded', 'rows_scanned', 'rows_matched', 'rows_created',
+                    'rows_changed', 'rows_unchanged', 'rows_expired', 'from_cache', 'duration', 'failed')
+    list_filter = ('affiliate', 'from_cache')
+    change_list_template = 'admin/games/affiliatesyncstat/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('trends/', self.admin_site.admin_view(self.trends_view), name='games_affiliatesyncstat_trends'),
+        ] + super().get_urls()
+
+    def trends_view(self, request):
+        """
+        Trend charts of the latest syncs of every affiliate.
+        """
+        charts = []
+        for affiliate in Affiliate.objects.order_by('name'):
+            stats = list(affiliate.sync_stats.order_by('-created_at')[:TREND_SYNCS])[::-1]
+            if not stats:
+                continue
+            latest = stats[-1]
+            charts.append({
+                'affiliate': affiliate,
+                'latest': latest,
+                'failures': sum(stat.failed for stat in stats),
+                'series': [
+                    ('Matched rows', sparkline([stat.rows_matched for stat in stats]), latest.rows_matched),
+                    ('Duration (s)', sparkline([stat.duration for stat in stats]), f"{latest.duration:.1f}"),
+                    ('Throughput (KB/s)', sparkline([stat.throughput / 1024 for stat in stats]), f"{latest.throughput / 1024:.0f}"),
+                ],
+            })
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sync trends',
+            'charts': charts,
+            'trend_syncs': TREND_SYNCS,
+        }
+        return TemplateResponse(request, 'admin/games/affiliatesyncstat/trends.html', context)
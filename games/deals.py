@@ -0,0 +1,109 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.utils import timezone
+
+from games.models import AffiliateGame, Game, GamePriceStats
+
+# An offer is a deal when it's at least this percentage below the median price of the game
+DEAL_MIN_DISCOUNT = Decimal('15')
+
+# Number of offers fetched from the database at a time
+CHUNK_SIZE = 5000
+
+# Number of stats per insert or update statement
+WRITE_BATCH_SIZE = 500
+
+# Fields of GamePriceStats that are computed from the offers
+STATS_FIELDS = ('offer_count', 'lowest_price', 'median_price', 'highest_price', 'discount', 'is_deal', 'is_price_drop')
+
+CENTS = Decimal('0.01')
+TENTHS = Decimal('0.1')
+
+
+def median(sorted_prices):
+    middle, odd = divmod(len(sorted_prices), 2)
+    if odd:
+        return sorted_prices[middle]
+    return ((sorted_prices[middle - 1] + sorted_prices[middle]) / 2).quantize(CENTS, ROUND_HALF_EVEN)
+
+
+def compute_price_stats(min_discount=DEAL_MIN_DISCOUNT, previous_stats=None):
+    """
+    Yields a tuple of (game_id, stats) for every game with an offer in stock, with the values of STATS_FIELDS.
+
+    The prices are the effective prices including shipping to the Netherlands, like the export.
+    The in stock offers of all games are read in one pass, ordered by game and price, so the statistics
+    of a game are computed from a sorted list without a query per game.
+
+    :param min_discount: Percentage the lowest price must be below the median price to be a deal.
+    :param previous_stats: Optional dict of game_id -> stats tuple from the previous run. A price drop
+        stays flagged until the lowest price changes, even when the export updated the last lowest price.
+    """
+    previous_stats = previous_stats or {}
+    last_lowest_prices = dict(Game.objects.filter(last_lowest_price__gt=0).values_list('ean', 'last_lowest_price'))
+
+    offers = AffiliateGame.objects.filter(stock__gt=0).order_by('game_id', 'effective_price_nl').values_list(
+        'game_id', 'effective_price_nl')
+    for game_id, game_offers in groupby(offers.iterator(chunk_size=CHUNK_SIZE), key=itemgetter(0)):
+        prices = [price for _, price in game_offers]
+        lowest_price = prices[0]
+        median_price = median(prices)
+        discount = Decimal(0)
+        if median_price > 0:
+            discount = ((median_price - lowest_price) * 100 / median_price).quantize(TENTHS, ROUND_HALF_EVEN)
+
+        last_lowest_price = last_lowest_prices.get(game_id)
+        previous = previous_stats.get(game_id)
+        is_price_drop = bool(last_lowest_price and lowest_price < last_lowest_price) or bool(
+            previous and previous[1] == lowest_price and previous[6])
+
+        yield game_id, (
+            len(prices),
+            lowest_price,
+            median_price,
+            prices[-1],
+            discount,
+            len(prices) > 1 and discount >= min_discount,
+            is_price_drop,
+        )
+
+
+def update_price_stats(min_discount=DEAL_MIN_DISCOUNT):
+    """
+    Recomputes the price statistics and deal flags of all games, returns a tuple of
+    (created_count, updated_count, deleted_count).
+
+    Like the price updates only new and changed statistics are written, so updated_at only
+    changes for games whose offers changed. Statistics of games without an offer in stock are deleted.
+    """
+    previous_stats = {stats[0]: stats[1:] for stats in GamePriceStats.objects.values_list('game_id', *STATS_FIELDS)}
+
+    now = timezone.now()
+    stale_ids = set(previous_stats)
+    new_stats = []
+    changed_stats = []
+    for game_id, stats in compute_price_stats(min_discount, previous_stats):
+        stale_ids.discard(game_id)
+        previous = previous_stats.get(game_id)
+        if previous == stats:
+            continue
+        game_stats = GamePriceStats(game_id=game_id, updated_at=now, **dict(zip(STATS_FIELDS, stats)))
+        if previous is None:
+            new_stats.append(game_stats)
+        else:
+            changed_stats.append(game_stats)
+
+    # What's left are games without an offer in stock anymore
+    stale_ids = list(stale_ids)
+
+    with transaction.atomic():
+        GamePriceStats.objects.bulk_create(new_stats, batch_size=WRITE_BATCH_SIZE)
+        # bulk_update doesn't set auto_now fields, updated_at is set above
+        GamePriceStats.objects.bulk_update(changed_stats, list(STATS_FIELDS) + ['updated_at'], batch_size=WRITE_BATCH_SIZE)
+        for start in range(0, len(stale_ids), WRITE_BATCH_SIZE):
+            GamePriceStats.objects.filter(game_id__in=stale_ids[start:start + WRITE_BATCH_SIZE]).delete()
+
+    return len(new_stats), len(changed_stats), len(stale_ids)
@@ -0,0 +1,98 @@
+import hashlib
+
+from django.db.models import Exists, Min, Max, OuterRef, Q, Count, Subquery
+from django.template.loader import render_to_string
+
+from games.formatting import format_price
+from games.models import Affiliate, AffiliateGame, Game, GamePriceStats
+
+# Bump when the content of the export changes, so cached exports and ETags are invalidated
+EXPORT_VERSION = 4
+
+EXPORT_HEADER = ['SKU', 'Original Name', 'Regular price', 'In stock?', 'Short description']
+
+# Number of games fetched from the database at a time
+CHUNK_SIZE = 2000
+
+
+def export_games():
+    """
+    Returns the games to export, annotated with their lowest affiliate price including shipping
+    to the Netherlands and stock status.
+    """
+    return Game.objects.select_related('price_stats').annotate(
+        # Get the lowest price from affiliates where stock > 0
+        lowest_price=Min('affiliate_games__effective_price_nl', filter=Q(affiliate_games__stock__gt=0)),
+        # Count the number of affiliates with stock > 0
+        in_stock=Count('affiliate_games', filter=Q(affiliate_games__stock__gt=0))
+    ).order_by('ean')
+
+
+def iter_export_rows(chunk_size=CHUNK_SIZE, save_lowest_prices=True, games=None):
+    """
+    Yields the rows of the WordPress export, fetching the games in chunks so memory usage
+    doesn't grow with the size of the catalogue.
+
+    :param chunk_size: Number of games fetched from the database at a time.
+    :param save_lowest_prices: Store new lowest prices in Game.last_lowest_price.
+    :param games: Optional subset of export_games() to export.
+    """
+    if games is None:
+        games = export_games()
+
+    # Games with a new lowest price, saved in batches
+    changed_games = []
+
+    for game in games.iterator(chunk_size=chunk_size):
+        # Generate short description from template
+        short_description = render_to_string(
+            'description_template.html',  # Create this template
+            {'game': game}
+        ).strip().replace('\n', '').replace('\r', '')
+
+        # Define the stock status as 1 if any affiliate has stock, else 0
+        stock_status = 1 if game.in_stock > 0 else 0
+
+        if game.lowest_price and game.lowest_price != game.last_lowest_price:
+            game.last_lowest_price = game.lowest_price
+            if save_lowest_prices:
+                changed_games.append(game)
+                if len(changed_games) >= chunk_size:
+                    Game.objects.bulk_update(changed_games, ['last_lowest_price'])
+                    changed_games = []
+
+        yield [
+            game.ean,
+            game.name,
+            format_price(game.last_lowest_price),
+            stock_status,
+            short_description,
+        ]
+
+    if changed_games:
+        Game.objects.bulk_update(changed_games, ['last_lowest_price'])
+
+
+def update_last_lowest_prices():
+    """
+    Stores the current lowest price of every game that is in stock in Game.last_lowest_price,
+    in a single statement. Same result as iter_export_rows with save_lowest_prices.
+    """
+    in_stock_offers = AffiliateGame.objects.filter(game=OuterRef('pk'), stock__gt=0)
+    lowest_price = in_stock_offers.order_by().values('game').annotate(lowest_price=Min('effective_price_nl')).values('lowest_price')
+    return Game.objects.filter(Exists(in_stock_offers)).update(last_lowest_price=Subquery(lowest_price))
+
+
+def export_etag():
+    """
+    Returns a tag that changes whenever the exported data changes, i.e. after every sync that
+    added, changed or removed games, affiliate offers or deals, or after an affiliate was renamed.
+    """
+    games = Game.objects.aggregate(updated_at=Max('updated_at'), count=Count('ean'))
+    offers = AffiliateGame.objects.aggregate(updated_at=Max('updated_at'), count=Count('id'))
+    stats = GamePriceStats.objects.aggregate(updated_at=Max('updated_at'), count=Count('game'))
+    # Affiliates have no modification time, the names are in the descriptions
+    affiliates = list(Affiliate.objects.order_by('pk').values_list('pk', 'name'))
+    state = (f"{EXPORT_VERSION}|{games['updated_at']}|{games['count']}|{offers['updated_at']}|{offers['count']}"
+             f"|{stats['updated_at']}|{stats['count']}|{affiliates}")
+    return hashlib.sha256(state.encode()).hexdigest()[:32]
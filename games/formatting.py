@@ -0,0 +1,22 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+CENT = Decimal('0.01')
+
+# Exponent of a Decimal with two decimal places, like the prices from the database
+CENT_EXPONENT = CENT.as_tuple().exponent
+
+
+def format_price(price) -> str:
+    """
+    Formats a price the Dutch way without thousands separator, e.g. 1234.5 -> '1234,50'.
+
+    Replaces the nl_NL locale formatting that was used before (locale.currency with the
+    thousands separator stripped), but doesn't depend on the locale being installed and
+    doesn't change the process-wide locale. The output is compared with the locale
+    formatting in games/tests.py and benchmarks/bench_price_format.py where it's installed.
+    """
+    if not isinstance(price, Decimal):
+        price = Decimal(str(price))
+    if price.as_tuple().exponent != CENT_EXPONENT:
+        price = price.quantize(CENT, rounding=ROUND_HALF_EVEN)
+    return str(price).replace('.', ',')
@@ -0,0 +1,117 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Set
+
+from django.db import connection, connections
+
+from games.models import Affiliate
+
+
+# Number of feeds that may be downloading at the same time
+MAX_CONCURRENT_DOWNLOADS = 4
+
+# Number of parser workers, each parsing one feed at a time
+PARSER_WORKERS = 2
+
+# Number of writers on databases that handle concurrent writes well. The offers of an affiliate
+# never conflict with those of another affiliate, so every writer stores a different affiliate
+# in its own transaction. SQLite allows only one writer at a time, so it always uses one.
+WRITER_WORKERS = os.cpu_count() or 1
+
+# Maximum number of feeds waiting between two stages. When a queue is full the
+# previous stage waits, so fast downloads can't pile up unparsed feeds in memory.
+QUEUE_SIZE = 2
+
+# Marks the end of a queue
+_DONE = object()
+
+
+def run_affiliate_pipeline(command, affiliates: Iterable[Affiliate], use_sample: bool,
+                           handle_game_data: Callable, game_eans: Set[str] = None) -> List:
+    """
+    Process affiliate feeds with an asyncio pipeline: feeds are downloaded concurrently, parsed in a
+    thread pool and handed to the writers that store the results in the database. On PostgreSQL
+    every writer thread uses its own connection, on other databases there is a single writer.
+
+    :param command: The AffiliateCommandBase instance used to fetch and parse the feeds.
+    :param affiliates: The affiliates to process.
+    :param use_sample: Use sample data instead of fetching from actual URLs.
+    :param handle_game_data: Called as handle_game_data(affiliate, game_data) for every affiliate,
+        from a writer thread with its own database connection. game_data is None if the feed
+        could not be processed, like AffiliateCommandBase.process_affiliate.
+    :param game_eans: Optional set of EANs to filter the feeds on.
+    :return: List with the return values of handle_game_data.
+    """
+    writer_workers = WRITER_WORKERS if connection.vendor == 'postgresql' else 1
+    return asyncio.run(_run_pipeline(command, list(affiliates), use_sample, handle_game_data, game_eans, writer_workers))
+
+
+async def _run_pipeline(command, affiliates, use_sample, handle_game_data, game_eans, writer_workers):
+    loop = asyncio.get_running_loop()
+    parse_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    results = []
+
+    async def download(affiliate):
+        # The slot is held until the feed is queued, so downloads stall while the parsers are busy
+        async with download_slots:
+            command.stdout.write(f"Processing {affiliate.name} ({affiliate.program})...")
+            try:
+                content = await loop.run_in_executor(download_pool, command.fetch_feed_content, affiliate, use_sample)
+            except Exception as e:
+                command.stderr.write(f"Error processing {affiliate.name}: {e}")
+                command.affiliate_stat(affiliate).error = f"{type(e).__name__}: {e}"
+                content = None
+            await parse_queue.put((affiliate, content))
+
+    async def parse():
+        while (item := await parse_queue.get()) is not _DONE:
+            affiliate, content = item
+            game_data = None
+            if content:
+                try:
+                    game_data = await loop.run_in_executor(
+                        parse_pool, command.parse_feed_content, affiliate, content, game_eans)
+                except Exception as e:
+                    command.stderr.write(f"Error processing {affiliate.name}: {e}")
+                    command.affiliate_stat(affiliate).error = f"{type(e).__name__}: {e}"
+            await write_queue.put((affiliate, game_data))
+
+    def write_in_thread(affiliate, game_data):
+        try:
+            return handle_game_data(affiliate, game_data)
+        finally:
+            # Writer threads are reused for other affiliates, don't keep a connection open in between
+            connections.close_all()
+
+    async def write():
+        error = None
+        while (item := await write_queue.get()) is not _DONE:
+            if error:
+                # Keep draining the queue so the other stages can finish
+                continue
+            affiliate, game_data = item
+            command.stdout.write("---")
+            try:
+                results.append(await loop.run_in_executor(writer_pool, write_in_thread, affiliate, game_data))
+            except Exception as e:
+                error = e
+        if error:
+            raise error
+
+    with ThreadPoolExecutor(MAX_CONCURRENT_DOWNLOADS) as download_pool, \
+            ThreadPoolExecutor(PARSER_WORKERS) as parse_pool, \
+            ThreadPoolExecutor(writer_workers) as writer_pool:
+        parsers = [asyncio.create_task(parse()) for _ in range(PARSER_WORKERS)]
+        writers = [asyncio.create_task(write()) for _ in range(writer_workers)]
+        await asyncio.gather(*(download(affiliate) for affiliate in affiliates))
+        for _ in parsers:
+            await parse_queue.put(_DONE)
+        await asyncio.gather(*parsers)
+        for _ in writers:
+            await write_queue.put(_DONE)
+        await asyncio.gather(*writers)
+
+    return results
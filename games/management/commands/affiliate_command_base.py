@@ -1,207 +1,411 @@
 import csv
 import gzip
 import io
+import mmap
 import os
+import time
 from collections import namedtuple
-from typing import List, Set
+from contextlib import contextmanager
+from operator import itemgetter
+from typing import List, Optional, Set
 
-import requests
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from games.models import Affiliate
+from games.management.commands.affiliate_feed_cache import FeedCache, hash_game_eans
+from games.management.commands.affiliate_feed_reader import (
+    FeedBuffer, iter_feed_lines, map_feed_file, sniff_feed_delimiter,
+)
+from games.models import Affiliate, AffiliateSyncStat
+from games.pricing import parse_price
 
 
-def get_csv_reader(file_path_or_lines, delimiter=None):
+def _read_csv_lines(file_path_or_lines, delimiter=None):
     """
-    Reads and returns CSV data as a DictReader.
-
-    :param file_path_or_lines: Path to a file or a list of lines from a response.
-    :param delimiter: Optional delimiter to force usage.
-    :return: A CSV DictReader instance.
+    Returns the lines of the CSV data and the delimiter, sniffed from the first lines if not given.
     """
     if isinstance(file_path_or_lines, str):  # Assume it's a file path
-        with open(file_path_or_lines, 'r', encoding='utf-8') as f:
-            lines = f.read().splitlines()
-    else:  # Assume it's already lines (e.g., from response content)
-        lines = file_path_or_lines
+        file_path_or_lines = map_feed_file(file_path_or_lines)
+
+    if isinstance(file_path_or_lines, (bytes, mmap.mmap)):  # Raw content, decoded line by line
+        if not delimiter:
+            delimiter = sniff_feed_delimiter(file_path_or_lines)
+        return iter_feed_lines(file_path_or_lines), delimiter
+
+    lines = file_path_or_lines  # Assume it's already lines
 
     if not delimiter:
         sample = "\n".join(lines[:10])  # Use first 10 lines as sample
         sniffer = csv.Sniffer()
         delimiter = sniffer.sniff(sample).delimiter
 
-    return csv.DictReader(lines, delimiter=delimiter)
+    return lines, delimiter
 
 
+def get_csv_reader(file_path_or_lines, delimiter=None):
+    """
+    Reads and returns CSV data as a DictReader.
 
-ParsedGameData = namedtuple('ParsedGameData', ['ean', 'price', 'stock', 'description', 'category', 'image', 'link'])
+    :param file_path_or_lines: Path to a file, raw feed content or a list of lines.
+    :param delimiter: Optional delimiter to force usage.
+    :return: A CSV DictReader instance.
+    """
+    lines, delimiter = _read_csv_lines(file_path_or_lines, delimiter)
+    return csv.DictReader(lines, delimiter=delimiter)
 
 
-class BaseAffiliateParser:
+def get_csv_rows(file_path_or_lines, delimiter=None):
     """
-    Base class for affiliate-specific data parsing.
+    Reads and returns CSV data as a plain reader, the first row is the header.
+
+    :param file_path_or_lines: Path to a file, raw feed content or a list of lines.
+    :param delimiter: Optional delimiter to force usage.
+    :return: A CSV reader instance.
     """
-    def parse_row(self, row):
-        """
-        Parse a single CSV row and return structured data.
-        Must be implemented by subclasses.
-        """
-        raise NotImplementedError("Subclasses must implement parse_row")
+    lines, delimiter = _read_csv_lines(file_path_or_lines, delimiter)
+    return csv.reader(lines, delimiter=delimiter)
 
 
-class AdtractionParser(BaseAffiliateParser):
-    def parse_row(self, row):
-        ean = int(row.get('Ean', 0) or 0)
-        if not ean:
-            return None
+# Bump when a parser changes its output, so cached parse results of older parsers are not used
+PARSER_VERSION = 5
+
+ParsedGameData = namedtuple('ParsedGameData', ['ean', 'price', 'stock', 'description', 'category', 'image', 'link'])
 
-        return ParsedGameData(
-            ean=ean,
-            price=float(row.get('Price', 0) or '0'),
-            stock=1 if row.get('Instock') == 'yes' else 0,
-            description=row.get('Description'),
-            category=row.get('Category', ''),
-            image=row.get('ImageUrl', ''),
-            link=row.get('TrackingUrl')
-        )
 
+def parse_ean(value):
+    return int(value or 0)
 
-class TradeTrackerParser(BaseAffiliateParser):
+
+def parse_int(value):
+    return int(value or 0)
+
+
+def price_with_decimal(separators):
     """
-    Parser for TradeTracker affiliate CSV data.
+    Price with the given decimal separator(s) and no thousands separators, e.g. price_with_decimal('.')
+    for prices like "12.99". Guessing the separator from the value would read "12.990" as 12990.
     """
-    def parse_row(self, row):
-        ean = int(row.get('EAN') or row.get('GTIN') or 0)
-        if not ean:
-            return None
+    return lambda value: parse_price(value, separators)
 
-        return ParsedGameData(
-            ean=ean,
-            price=float(row.get('price', 0) or '0'),
-            stock=1 if row.get('availability', '').lower() == 'op voorraad' else 0,
-            description=row.get('description'),
-            category=row.get('categories', ''),
-            image=row.get('imageURL', ''),
-            link=row.get('productURL', '')
-        )
+
+def in_stock_if(expected, ignore_case=False):
+    """
+    Stock rule: 1 if the column has the expected value, else 0.
+    """
+    if ignore_case:
+        expected = expected.lower()
+        return lambda value: 1 if value.lower() == expected else 0
+    return lambda value: 1 if value == expected else 0
 
 
-class AwinParser(BaseAffiliateParser):
+def in_stock_if_positive(value):
     """
-    Parser for Awin affiliate CSV data.
+    Stock rule: 1 if the column has a positive amount, else 0.
     """
-    def parse_row(self, row):
-        ean = int(row.get('ean') or 0)
-        if not ean:
-            return None
+    return 1 if int(value or 0) > 0 else 0
 
-        return ParsedGameData(
-            ean=ean,
-            price=float((row.get('store_price') or '0').replace(',', '.')),  # Handle prices with commas
-            stock=int(row.get('stock_quantity') or '0'),
-            description=row.get('description'),
-            category=row.get('merchant_category', ''),
-            image=row.get('merchant_image_url', ''),
-            link=row.get('aw_deep_link', '')
-        )
 
+class Column:
+    """
+    Maps a field of ParsedGameData to a feed column.
 
-class DaisyconParser(BaseAffiliateParser):
+    :param names: Column names, the first one with a non-empty value is used.
+    :param cast: Optional function to convert the column value.
     """
-    Parser for Daisycon affiliate CSV data.
+    def __init__(self, *names, cast=None):
+        self.names = names
+        self.cast = cast
+
+    def compile(self, header_index):
+        """
+        Returns a function that gets the value of this column from a csv.reader row.
+        """
+        cast = self.cast
+        indexes = [header_index[name] for name in self.names if name in header_index]
+
+        if not indexes:
+            # The column is missing from this feed
+            value = cast('') if cast else ''
+            return lambda row: value
+
+        if len(indexes) == 1:
+            index = indexes[0]
+            if cast:
+                return lambda row: cast(row[index])
+            return itemgetter(index)
+
+        def get_first(row):
+            value = next((row[index] for index in indexes if row[index]), '')
+            return cast(value) if cast else value
+        return get_first
+
+
+class FeedParser:
     """
-    def parse_row(self, row):
-        ean = int(row.get('ean') or 0)
-        if not ean:
-            return None
+    Declarative parser for an affiliate feed: maps every field of ParsedGameData to a column.
 
-        return ParsedGameData(
-            ean=ean,
-            price=float(row.get('price', 0) or '0'),
-            stock=int(row.get('in_stock_amount', 0) or '0') > 0,
-            description=row.get('description'),
-            category=row.get('category', ''),
-            image=row.get('image_default', ''),
-            link=row.get('link', '')
-        )
+    The mapping is compiled once per feed header into index based accessors, so rows can be
+    read with a plain csv.reader instead of a DictReader.
+    """
+    def __init__(self, **columns: Column):
+        missing = set(ParsedGameData._fields) - set(columns)
+        if missing:
+            raise ValueError(f"Missing columns for {', '.join(sorted(missing))}")
+        self.columns = columns
 
+    def parse_rows(self, rows, game_eans: Set[int] = None) -> List[ParsedGameData]:
+        """
+        Parse csv.reader rows, the first row is the header. Rows without EAN, or with an EAN that is
+        not in `game_eans` (if given), are skipped.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if not header:
+            return []
+
+        header_index = {}
+        for index, name in enumerate(header):
+            header_index.setdefault(name, index)
+        width = len(header)
+
+        get_ean = self.columns['ean'].compile(header_index)
+        getters = [self.columns[field].compile(header_index) for field in ParsedGameData._fields[1:]]
+
+        parsed_data = []
+        for row in rows:
+            if len(row) < width:
+                row += [''] * (width - len(row))
+
+            ean = get_ean(row)
+            if not ean or (game_eans and ean not in game_eans):
+                continue
+            parsed_data.append(ParsedGameData(ean, *[getter(row) for getter in getters]))
 
+        return parsed_data
 
-# Mapping affiliate programs to their parsers
+
+# Mapping affiliate programs to their parsers. To support a new program, add it to
+# Affiliate.Program and map its feed columns here.
 AFFILIATE_PARSERS = {
-    Affiliate.Program.ADTRACTION: AdtractionParser,
-    Affiliate.Program.TRADETRACKER: TradeTrackerParser,
-    Affiliate.Program.AWIN: AwinParser,
-    Affiliate.Program.DAISYCON: DaisyconParser,
+    Affiliate.Program.ADTRACTION: FeedParser(
+        ean=Column('Ean', cast=parse_ean),
+        price=Column('Price', cast=price_with_decimal('.')),
+        stock=Column('Instock', cast=in_stock_if('yes')),
+        description=Column('Description'),
+        category=Column('Category'),
+        image=Column('ImageUrl'),
+        link=Column('TrackingUrl'),
+    ),
+    Affiliate.Program.TRADETRACKER: FeedParser(
+        ean=Column('EAN', 'GTIN', cast=parse_ean),
+        price=Column('price', cast=price_with_decimal('.')),
+        stock=Column('availability', cast=in_stock_if('op voorraad', ignore_case=True)),
+        description=Column('description'),
+        category=Column('categories'),
+        image=Column('imageURL'),
+        link=Column('productURL'),
+    ),
+    Affiliate.Program.AWIN: FeedParser(
+        ean=Column('ean', cast=parse_ean),
+        price=Column('store_price', cast=price_with_decimal('.,')),  # Prices with a comma or a dot
+        stock=Column('stock_quantity', cast=parse_int),
+        description=Column('description'),
+        category=Column('merchant_category'),
+        image=Column('merchant_image_url'),
+        link=Column('aw_deep_link'),
+    ),
+    Affiliate.Program.DAISYCON: FeedParser(
+        ean=Column('ean', cast=parse_ean),
+        price=Column('price', cast=price_with_decimal('.')),
+        stock=Column('in_stock_amount', cast=in_stock_if_positive),
+        description=Column('description'),
+        category=Column('category'),
+        image=Column('image_default'),
+        link=Column('link'),
+    ),
 }
 
 
-# Mapping of affiliate names to their sample data file paths, using BASE_DIR
-SAMPLE_DATA_PATHS = {
-    "999 Games": os.path.join(settings.BASE_DIR, 'games', 'sample_data', '999 Games.csv'),
-    "Coolshop": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Coolshop.csv'),
-    "Valhallaboardgames": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Valhallaboardgames.csv'),
-    "Spelhuis": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Spelhuis.csv'),
-    "Spelspul": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Spelspul.csv'),
-    "Spellenrijk": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Spellenrijk.csv'),
-    "Top1Toys": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Top1Toys.csv'),
-    "Alternate": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Alternate.csv'),
-    "Cardpile": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Cardpile.csv'),
-    "Degrotespeelgoedwinkel": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Degrotespeelgoedwinkel.csv'),
-    "Internet-Toys": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Internet-Toys.csv'),
-    "Blokker": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Blokker.csv'),
-    "Bruna": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'Bruna.csv'),
-    "De Spelletjes Vrienden": os.path.join(settings.BASE_DIR, 'games', 'sample_data', 'De Spelletjes Vrienden.csv'),
+# Affiliate names that have a sample data file in games/sample_data, named after the affiliate
+SAMPLE_DATA_AFFILIATES = {
+    "999 Games",
+    "Coolshop",
+    "Valhallaboardgames",
+    "Spelhuis",
+    "Spelspul",
+    "Spellenrijk",
+    "Top1Toys",
+    "Alternate",
+    "Cardpile",
+    "Degrotespeelgoedwinkel",
+    "Internet-Toys",
+    "Blokker",
+    "Bruna",
+    "De Spelletjes Vrienden",
 }
 
+
+def get_sample_data_path(affiliate_name: str) -> Optional[str]:
+    """
+    Returns the path of the sample data file of an affiliate, or None if it has no sample data.
+    """
+    if affiliate_name not in SAMPLE_DATA_AFFILIATES:
+        return None
+    return os.path.join(settings.BASE_DIR, 'games', 'sample_data', f'{affiliate_name}.csv')
+
+
 class AffiliateCommandBase(BaseCommand):
     """
     Base class for affiliate-related commands.
     """
-    def fetch_csv_data(self, affiliate: AFFILIATE_PARSERS, use_sample: bool):
+    use_feed_cache = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--use_sample_data',
+            action='store_true',
+            help='Use sample data instead of fetching from actual URLs',
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='use_async',
+            help='Download and parse affiliate feeds concurrently',
+        )
+        parser.add_argument(
+            '--no_cache',
+            action='store_true',
+            help='Always parse the feeds, even if an identical feed was parsed before',
+        )
+
+    def execute(self, *args, **options):
+        self.use_feed_cache = not options.get('no_cache')
+        # Statistics of the affiliates processed by this command, by affiliate id
+        self.sync_stats = {}
+        return super().execute(*args, **options)
+
+    def affiliate_stat(self, affiliate: Affiliate) -> AffiliateSyncStat:
+        """
+        Returns the (unsaved) statistics of an affiliate, which every stage adds to.
+        """
+        stat = self.sync_stats.get(affiliate.pk)
+        if stat is None:
+            stat = self.sync_stats[affiliate.pk] = AffiliateSyncStat(affiliate=affiliate)
+        return stat
+
+    @contextmanager
+    def timed(self, affiliate: Affiliate, field: str):
+        """
+        Adds the duration of the block to a duration field of the affiliate's statistics.
+        """
+        stat = self.affiliate_stat(affiliate)
+        start = time.monotonic()
+        try:
+            yield stat
+        finally:
+            setattr(stat, field, getattr(stat, field) + time.monotonic() - start)
+
+    def fetch_feed_content(self, affiliate: Affiliate, use_sample: bool) -> Optional[FeedBuffer]:
+        """
+        Returns the raw (unzipped) CSV content of an affiliate feed, or None if there is no data.
+        Sample data files are memory mapped instead of read.
+        """
+        with self.timed(affiliate, 'download_seconds'):
+            return self.download_feed(affiliate, use_sample)
+
+    def download_feed(self, affiliate: Affiliate, use_sample: bool) -> Optional[FeedBuffer]:
+        """
+        Downloads (or maps) the feed of an affiliate and records its size, see fetch_feed_content.
+        """
+        stat = self.affiliate_stat(affiliate)
         if use_sample:
-            csv_path = SAMPLE_DATA_PATHS.get(affiliate.name)
+            csv_path = get_sample_data_path(affiliate.name)
             if not csv_path:
                 self.stdout.write(f"No sample data found for {affiliate.name}. Skipping...")
                 return None
-            return get_csv_reader(csv_path)
+            content = map_feed_file(csv_path)
+            stat.bytes_downloaded = len(content)
+            return content
         else:
+            # Imported here, requests is slow to import and not needed for sample data and cached feeds
+            import requests
+
             self.stdout.write(f"Retrieving remote data for {affiliate.name}...")
             response = requests.get(affiliate.data_source_url)
             response.raise_for_status()
+            stat.bytes_downloaded = len(response.content)
 
             # Check if the response is a gzipped file
             if response.headers.get('Content-Type') == 'application/gzip':
                 # Unzip the content
                 with gzip.GzipFile(fileobj=io.BytesIO(response.content)) as gzipped_file:
-                    # Read the CSV data from the unzipped content
-                    csv_content = gzipped_file.read().decode('utf-8')
-            else:
-                csv_content = response.content.decode('utf-8')
-
-            return get_csv_reader(csv_content.splitlines())
+                    return gzipped_file.read()
+            return response.content
 
-    def process_affiliate(self, affiliate: Affiliate, use_sample: bool, game_eans: Set[str] = None) -> List[ParsedGameData]:
-        try:
-            csv_reader = self.fetch_csv_data(affiliate, use_sample)
-            if not csv_reader:
-                return []
+    def parse_feed_content(self, affiliate: Affiliate, content: FeedBuffer, game_eans: Set[str] = None) -> Optional[List[ParsedGameData]]:
+        """
+        Parse the CSV content of an affiliate feed, reusing the result of an earlier run for an identical feed.
+        Returns None if the affiliate's feed can't be parsed.
+        """
+        with self.timed(affiliate, 'parse_seconds') as stat:
+            parsed_data = self._parse_feed_content(affiliate, content, game_eans, stat)
+            stat.rows_matched = len(parsed_data) if parsed_data else 0
+        return parsed_data
+
+    def _parse_feed_content(self, affiliate, content, game_eans, stat):
+        if not self.use_feed_cache:
+            return self.parse_csv_rows(affiliate, content, game_eans, stat)
+
+        feed_cache = FeedCache()
+        parser_version = f"{affiliate.program}:{PARSER_VERSION}"
+        cache_key = feed_cache.make_key(content, parser_version, hash_game_eans(game_eans))
+
+        cached_rows = feed_cache.get(cache_key)
+        if cached_rows is not None:
+            self.stdout.write(f"Feed of {affiliate.name} is unchanged, using cached parse result")
+            stat.from_cache = True
+            return [ParsedGameData._make(row) for row in cached_rows]
+
+        parsed_data = self.parse_csv_rows(affiliate, content, game_eans, stat)
+        if parsed_data is not None:
+            feed_cache.set(cache_key, parsed_data)
+        return parsed_data
+
+    def parse_csv_rows(self, affiliate: Affiliate, content: FeedBuffer, game_eans: Set[str],
+                       stat: AffiliateSyncStat) -> Optional[List[ParsedGameData]]:
+        """
+        Parse the CSV content of an affiliate feed and record the number of lines that were read.
+        """
+        csv_rows = get_csv_rows(content)
+        parsed_data = self.parse_csv_data(affiliate, csv_rows, game_eans)
+        # Lines read after the header
+        stat.rows_scanned = max(csv_rows.line_num - 1, 0)
+        return parsed_data
 
-            parser_class = AFFILIATE_PARSERS.get(affiliate.program, None)
-            if not parser_class:
-                self.stdout.write(f"Unknown affiliate program: {affiliate.program}. Skipping...")
-                return []
+    def parse_csv_data(self, affiliate: Affiliate, csv_rows, game_eans: Set[str] = None) -> Optional[List[ParsedGameData]]:
+        """
+        Parse the rows of an affiliate feed (header first), keeping only games in `game_eans` (if given).
+        Returns None if there is no parser for the affiliate's program.
+        """
+        parser = AFFILIATE_PARSERS.get(affiliate.program, None)
+        if not parser:
+            self.stdout.write(f"Unknown affiliate program: {affiliate.program}. Skipping...")
+            return None
 
-            parser = parser_class()
-            parsed_data = []
+        return parser.parse_rows(csv_rows, game_eans)
 
-            for row in csv_reader:
-                data = parser.parse_row(row)
-                if data and (not game_eans or data.ean in game_eans):
-                    parsed_data.append(data)
+    def process_affiliate(self, affiliate: Affiliate, use_sample: bool, game_eans: Set[str] = None) -> Optional[List[ParsedGameData]]:
+        """
+        Fetch and parse the feed of an affiliate. Returns None if the feed could not be processed, as opposed
+        to an empty list for a feed without (matching) games.
+        """
+        try:
+            content = self.fetch_feed_content(affiliate, use_sample)
+            if not content:
+                return None
 
-            return parsed_data
+            return self.parse_feed_content(affiliate, content, game_eans)
         except Exception as e:
             self.stderr.write(f"Error processing {affiliate.name}: {e}")
-            return []
+            self.affiliate_stat(affiliate).error = f"{type(e).__name__}: {e}"
+            return None
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+
+
+# Bump when the layout of the cache files changes
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FILE_SUFFIX = '.pickle'
+
+
+def hash_game_eans(game_eans: Optional[Iterable[int]]) -> str:
+    """
+    Returns a stable hash of the catalogue EANs a feed was filtered on.
+    """
+    if not game_eans:
+        return 'all'
+    digest = hashlib.sha256()
+    for ean in sorted(game_eans):
+        digest.update(str(ean).encode())
+        digest.update(b',')
+    return digest.hexdigest()
+
+
+class FeedCache:
+    """
+    On-disk cache of parsed and EAN-filtered affiliate feeds.
+
+    Entries are keyed by the hash of the feed content, the parser that was used and the
+    catalogue EANs, so an identical feed doesn't need to be parsed again. The least
+    recently used entries are evicted once the cache grows over `max_size` bytes.
+    """
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or settings.FEED_CACHE_DIR
+        self.max_size = max_size if max_size is not None else settings.FEED_CACHE_MAX_SIZE
+
+    def make_key(self, content: bytes, parser_version: str, ean_hash: str) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(f'|{parser_version}|{ean_hash}'.encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def get(self, key: str) -> Optional[List[tuple]]:
+        """
+        Returns the cached rows for `key`, or None when there is no (valid) entry.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                version, rows = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt or unreadable entry, drop it
+            self._remove(path)
+            return None
+
+        if version != CACHE_FORMAT_VERSION:
+            self._remove(path)
+            return None
+
+        # Mark the entry as recently used, unless another process evicted it meanwhile
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def set(self, key: str, rows: List[tuple]):
+        """
+        Stores the rows for `key` and evicts old entries if the cache got too big.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((CACHE_FORMAT_VERSION, [tuple(row) for row in rows]), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in `max_size`.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(CACHE_FILE_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,70 @@
+import codecs
+import csv
+import mmap
+import os
+from typing import Iterator, Union
+
+# Number of bytes at the start of a feed the delimiter is sniffed from
+SNIFF_SIZE = mmap.PAGESIZE
+
+# Raw feed content: downloaded bytes or a memory mapped local file
+FeedBuffer = Union[bytes, mmap.mmap]
+
+
+def map_feed_file(path: str) -> FeedBuffer:
+    """
+    Maps a local feed file into memory, read-only.
+
+    Pages are only read from disk when they are accessed and are shared with the OS page cache,
+    so replaying a big feed doesn't copy it into the process. The map is closed when it's no
+    longer referenced. Returns b'' for an empty file, which can't be mapped.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _content_start(buffer: FeedBuffer) -> int:
+    # Skip the UTF-8 byte order mark some feeds (and Excel exports) start with
+    return len(codecs.BOM_UTF8) if buffer[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+
+
+def iter_feed_lines(buffer: FeedBuffer, encoding='utf-8') -> Iterator[str]:
+    """
+    Yields the lines of the feed content without line endings, skipping a byte order mark.
+
+    Every line is a slice of the buffer that is decoded only when it's reached, so the content
+    is never decoded or split as a whole.
+    """
+    start = _content_start(buffer)
+    end = len(buffer)
+    find = buffer.find
+    with memoryview(buffer) as view:
+        while start < end:
+            newline = find(b'\n', start)
+            if newline == -1:
+                newline = end
+            line = str(view[start:newline], encoding)
+            if '\r' in line:
+                # Windows line ending, or lines that end in a lone '\r'
+                yield from line.rstrip('\r').split('\r')
+            else:
+                yield line
+            start = newline + 1
+
+
+def sniff_feed_delimiter(buffer: FeedBuffer, encoding='utf-8') -> str:
+    """
+    Sniffs the CSV delimiter from the first page of the feed content, cut off after the last complete line.
+    """
+    start = _content_start(buffer)
+    sample = buffer[start:start + SNIFF_SIZE]
+    last_newline = sample.rfind(b'\n')
+    if last_newline == -1:
+        # The first line is longer than a page, use the whole line
+        newline = buffer.find(b'\n', start)
+        sample = buffer[start:newline if newline != -1 else len(buffer)]
+    else:
+        sample = sample[:last_newline]
+    return csv.Sniffer().sniff(sample.decode(encoding)).delimiter
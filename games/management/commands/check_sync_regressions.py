@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from games.sync_stats import BASELINE_WINDOW, DEVIATION_THRESHOLD, MIN_BASELINE_SYNCS, find_regressions
+
+
+class Command(BaseCommand):
+    help = 'Flag affiliates whose latest sync failed or deviates sharply from their earlier syncs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window',
+            type=int,
+            default=BASELINE_WINDOW,
+            help='Number of earlier syncs of an affiliate to compare with',
+        )
+        parser.add_argument(
+            '--min_syncs',
+            type=int,
+            default=MIN_BASELINE_SYNCS,
+            help='Minimum number of successful earlier syncs needed to compare with',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=DEVIATION_THRESHOLD,
+            help='Flag a sync when its throughput is below, or its matched rows are outside, '
+                 'this fraction of the median of the earlier syncs',
+        )
+
+    def handle(self, *args, **options):
+        if not 0 < options['threshold'] < 1:
+            raise CommandError('--threshold must be between 0 and 1')
+
+        regressions = find_regressions(options['window'], options['min_syncs'], options['threshold'])
+        for affiliate, problem in regressions:
+            self.stderr.write(f"{affiliate.name}: {problem}")
+
+        if regressions:
+            # A non-zero exit status, so a cron job or monitoring check can alert on it
+            raise CommandError(f"Found {len(regressions)} sync regressions")
+        self.stdout.write("No sync regressions found")
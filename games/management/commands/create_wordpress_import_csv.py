@@ -1,71 +1,191 @@
 # games/management/commands/export_game_data.py
 
 import csv
-import locale
+import gzip
+import hashlib
+import io
+import json
 import os
-
-from django.core.management.base import BaseCommand
-from django.db.models import Min, Max, Q, Count
-from django.template.loader import render_to_string
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Mod
 from django.utils import timezone
 
-from games.models import Game
+from games.exports import CHUNK_SIZE, EXPORT_HEADER, export_games, iter_export_rows, update_last_lowest_prices
+from games.models import AffiliateGame
+
+# Shards by the EAN modulo the number of shards, which spreads evenly as the last digit of an EAN is a check digit
+SHARD_BY_EAN = 'ean'
+SHARD_BY_CATEGORY = 'category'
+SHARD_BY_ROWS = 'rows'
+
+# Number of files when sharding by EAN or rows
+DEFAULT_SHARDS = 4
 
-locale.setlocale(locale.LC_ALL, 'nl_NL.UTF-8')
+
+def write_csv_file(file_path, rows, use_gzip):
+    """
+    Writes the export header and rows to a (gzip compressed) CSV file, returns the number of rows written.
+    """
+    row_count = 0
+    with open(file_path, 'wb') as raw_file:
+        with (gzip.GzipFile(fileobj=raw_file, mode='wb') if use_gzip else raw_file) as binary_file, \
+                io.TextIOWrapper(binary_file, encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            # Write the header row
+            writer.writerow(EXPORT_HEADER)
+            for row in rows:
+                writer.writerow(row)
+                row_count += 1
+    return row_count
 
 
-def format_price(price):
-    return locale.currency(price, symbol=False, grouping=True).replace(' ', '')
+def file_checksum(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 class Command(BaseCommand):
     help = 'Export game data to CSV with lowest affiliate prices and stock status.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Write gzip compressed CSV files',
+        )
+        parser.add_argument(
+            '--chunk_size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Number of games fetched from the database at a time',
+        )
+        parser.add_argument(
+            '--shard_by',
+            choices=[SHARD_BY_EAN, SHARD_BY_CATEGORY, SHARD_BY_ROWS],
+            help='Split the export in multiple files, by EAN modulo the number of shards, by affiliate category '
+                 'or by row count',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            help=f'Number of files to split the export in when sharding by EAN or rows (default {DEFAULT_SHARDS})',
+        )
+
     def handle(self, *args, **options):
+        if options['shards'] is None:
+            options['shards'] = DEFAULT_SHARDS
+        elif options['shard_by'] not in (SHARD_BY_EAN, SHARD_BY_ROWS):
+            raise CommandError('--shards can only be used with --shard_by ean or rows')
+        elif options['shards'] < 1:
+            raise CommandError('--shards must be at least 1')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk_size must be at least 1')
+
         # Create the exports directory if it doesn't exist
         export_dir = 'exports'
         os.makedirs(export_dir, exist_ok=True)
 
         # Create a timestamped filename
         timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-        file_path = os.path.join(export_dir, f'game_data_export_{timestamp}.csv')
-
-        # Open the CSV file for writing
-        with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            # Write the header row
-            writer.writerow(['SKU', 'Original Name', 'Regular price', 'In stock?', 'Short description'])
-
-            # Fetch games with lowest affiliate prices and stock status
-            games = Game.objects.annotate(
-                # Get the lowest price from affiliates where stock > 0
-                lowest_price=Min('affiliate_games__price', filter=Q(affiliate_games__stock__gt=0)),
-                # Count the number of affiliates with stock > 0
-                in_stock=Count('affiliate_games', filter=Q(affiliate_games__stock__gt=0))
-            )
-
-            # Loop through each game and write its data to the CSV file
-            for game in games:
-                # Generate short description from template
-                short_description = render_to_string(
-                    'description_template.html',  # Create this template
-                    {'game': game}
-                ).strip().replace('\n', '').replace('\r', '')
-
-                # Define the stock status as 1 if any affiliate has stock, else 0
-                stock_status = 1 if game.in_stock > 0 else 0
-
-                if game.lowest_price:
-                    game.last_lowest_price = game.lowest_price
-                    game.save(update_fields=['last_lowest_price'])
-
-                # Write game data row
-                writer.writerow([
-                    game.ean,
-                    game.name,
-                    format_price(game.last_lowest_price),
-                    stock_status,
-                    short_description,
-                ])
+        file_path = os.path.join(export_dir, f'game_data_export_{timestamp}')
+
+        if options['shard_by']:
+            self.export_shards(file_path, options)
+            self.stdout.write(self.style.SUCCESS(f'Data successfully exported to {file_path}/'))
+            return
+
+        file_path += '.csv.gz' if options['gzip'] else '.csv'
+
+        # Write to a temporary file first, it's renamed when the export is complete so
+        # consumers never see a half-written export
+        fd, tmp_path = tempfile.mkstemp(dir=export_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            write_csv_file(tmp_path, iter_export_rows(options['chunk_size']), options['gzip'])
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
         self.stdout.write(self.style.SUCCESS(f'Data successfully exported to {file_path}'))
+
+    def get_shards(self, shard_by, shard_count):
+        """
+        Returns a list of (key, games) tuples, one for every shard.
+        """
+        games = export_games()
+
+        if shard_by == SHARD_BY_EAN:
+            games = games.annotate(shard=Mod(F('ean'), shard_count))
+            return [(str(index), games.filter(shard=index)) for index in range(shard_count)]
+
+        if shard_by == SHARD_BY_ROWS:
+            shard_size = -(-games.count() // shard_count) or 1
+            return [(str(index), games[index * shard_size:(index + 1) * shard_size]) for index in range(shard_count)]
+
+        # Shard by the category of the cheapest offer that is in stock
+        cheapest_offers = AffiliateGame.objects.filter(game=OuterRef('pk'), stock__gt=0).order_by('effective_price_nl')
+        games = games.annotate(shard_category=Subquery(cheapest_offers.values('category__name')[:1]))
+        categories = sorted(set(games.values_list('shard_category', flat=True).order_by()), key=lambda c: c or '')
+        return [(category or 'none', games.filter(shard_category=category)) for category in categories]
+
+    def export_shards(self, export_path, options):
+        """
+        Writes the export as multiple CSV files in parallel, with a manifest.json that lists the
+        files with their row count and checksum.
+        """
+        shards = self.get_shards(options['shard_by'], options['shards'])
+        suffix = '.csv.gz' if options['gzip'] else '.csv'
+
+        # Write to a temporary directory first, it's renamed when all shards are complete
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(export_path), suffix='.tmp')
+
+        def write_shard(index, games):
+            try:
+                file_name = f'shard_{index:03d}{suffix}'
+                shard_path = os.path.join(tmp_dir, file_name)
+                # Lowest prices are saved afterwards, writing them from parallel shards would lock SQLite
+                rows = iter_export_rows(options['chunk_size'], save_lowest_prices=False, games=games)
+                row_count = write_csv_file(shard_path, rows, options['gzip'])
+                return {
+                    'file': file_name,
+                    'rows': row_count,
+                    'size': os.path.getsize(shard_path),
+                    'sha256': file_checksum(shard_path),
+                }
+            finally:
+                # Every thread uses its own database connection
+                connection.close()
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(shards), os.cpu_count() or 1) or 1) as executor:
+                futures = [executor.submit(write_shard, index, games) for index, (key, games) in enumerate(shards)]
+                manifest_shards = [dict(key=key, **future.result()) for (key, games), future in zip(shards, futures)]
+
+            update_last_lowest_prices()
+
+            manifest = {
+                'created_at': timezone.now().isoformat(),
+                'shard_by': options['shard_by'],
+                'total_rows': sum(shard['rows'] for shard in manifest_shards),
+                'shards': manifest_shards,
+            }
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+
+            os.rename(tmp_dir, export_path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        for shard in manifest_shards:
+            self.stdout.write(f"{shard['file']} ({shard['key']}): {shard['rows']} games")
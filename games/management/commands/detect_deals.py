@@ -0,0 +1,30 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from games.deals import DEAL_MIN_DISCOUNT, update_price_stats
+from games.models import GamePriceStats
+
+
+class Command(BaseCommand):
+    help = 'Compute the price statistics of all games and flag deals and price drops'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min_discount',
+            type=Decimal,
+            default=DEAL_MIN_DISCOUNT,
+            help='Percentage the lowest price must be below the median price of a game to be a deal',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        created_count, updated_count, deleted_count = update_price_stats(options['min_discount'])
+        duration = time.monotonic() - start
+
+        self.stdout.write(
+            f"Updated price stats in {duration:.1f}s: {created_count} added, {updated_count} changed, {deleted_count} removed. "
+            f"{GamePriceStats.objects.filter(is_deal=True).count()} deals, "
+            f"{GamePriceStats.objects.filter(is_price_drop=True).count()} price drops."
+        )
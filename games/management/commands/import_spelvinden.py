@@ -1,24 +1,20 @@
 # your_app/management/commands/update_prices.py
 
 import csv
-import requests
 import os
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from games import pricing
 from games.models import Affiliate, AffiliateGame, Game  # Update with your actual models
 
 
 def parse_price(price_str):
     try:
-        # Remove thousands separator (.)
-        normalized_price = price_str.replace('.', '')
-        # Replace decimal comma (,) with a dot (.)
-        normalized_price = normalized_price.replace(',', '.')
-        # Convert to float
-        return float(normalized_price)
+        # Dutch prices, with a dot as thousands separator and a comma as decimal separator
+        return pricing.parse_price(price_str, ',', '.')
     except ValueError:
         raise ValueError(f"Invalid price format: {price_str}")
 
@@ -57,9 +53,10 @@ class Command(BaseCommand):
 
         reader = csv.DictReader(csv_data, delimiter=',')
 
-        Game.objects.all().delete()
-
         with transaction.atomic():
+            # Deleted in the same transaction, so a row that can't be imported leaves the games as they were
+            Game.objects.all().delete()
+
             for row in reader:
                 ean = row.get('SKU')
                 name = row.get('Name')
@@ -0,0 +1,111 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils import timezone
+
+from games.management.commands.update_prices import STALE_OFFERS_DELETE, STALE_OFFERS_KEEP, STALE_OFFERS_ZERO
+from games.models import SyncJob
+from games.sync_jobs import create_batch, fail_expired_jobs
+from games.sync_stats import finish_run, get_batch_run
+
+
+class Command(BaseCommand):
+    help = 'Queue a sync job for every enabled affiliate and export the data once all jobs are finished'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--use_sample_data',
+            action='store_true',
+            help='Use sample data instead of fetching from actual URLs',
+        )
+        parser.add_argument(
+            '--min_interval',
+            type=int,
+            default=0,
+            help='Skip affiliates that were synced successfully within this many minutes',
+        )
+        parser.add_argument(
+            '--stale_offers',
+            choices=[STALE_OFFERS_ZERO, STALE_OFFERS_DELETE, STALE_OFFERS_KEEP],
+            default=STALE_OFFERS_ZERO,
+            help='What the workers do with offers of games that are no longer in the feed, see update_prices',
+        )
+        parser.add_argument(
+            '--no_cache',
+            action='store_true',
+            help='Let the workers always parse the feeds, even if an identical feed was parsed before',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Start this many local sync_worker processes, besides workers running elsewhere',
+        )
+        parser.add_argument(
+            '--poll_interval',
+            type=float,
+            default=5,
+            help='Seconds between checks whether all jobs are finished',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=120,
+            help='Minutes to wait for the jobs to finish',
+        )
+        parser.add_argument(
+            '--no_export',
+            action='store_true',
+            help="Don't create the WordPress export when the jobs are finished",
+        )
+
+    def handle(self, *args, **options):
+        min_interval = timedelta(minutes=options['min_interval']) if options['min_interval'] else None
+        batch = create_batch(options['use_sample_data'], min_interval, options['stale_offers'], not options['no_cache'])
+        self.stdout.write(f"Created {batch} with {batch.jobs.count()} jobs")
+
+        workers = [
+            subprocess.Popen([
+                sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'sync_worker', '--wait',
+                '--worker_id', f'{socket.gethostname()}-{os.getpid()}-{index}',
+                '--poll_interval', str(options['poll_interval']),
+            ])
+            for index in range(options['workers'])
+        ]
+
+        try:
+            deadline = time.monotonic() + options['timeout'] * 60
+            while not batch.is_finished:
+                if time.monotonic() > deadline:
+                    raise CommandError(f"Jobs of {batch} did not finish within {options['timeout']} minutes")
+                time.sleep(options['poll_interval'])
+                fail_expired_jobs()
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.wait()
+
+        status_counts = dict(batch.jobs.values_list('status').annotate(count=Count('pk')).order_by())
+        self.stdout.write('---')
+        self.stdout.write(', '.join(
+            f"{label}: {status_counts.get(status, 0)}" for status, label in SyncJob.Status.choices
+        ))
+        for job in batch.jobs.filter(status=SyncJob.Status.FAILED).select_related('affiliate'):
+            self.stderr.write(f"Sync of {job.affiliate.name} failed after {job.attempts} attempts: {job.last_error}")
+
+        finish_run(get_batch_run(batch))
+        call_command('detect_deals', stdout=self.stdout, stderr=self.stderr)
+
+        if not options['no_export']:
+            call_command('create_wordpress_import_csv', stdout=self.stdout, stderr=self.stderr)
+            batch.exported_at = timezone.now()
+            batch.save(update_fields=['exported_at'])
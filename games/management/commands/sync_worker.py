@@ -0,0 +1,117 @@
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+
+from games.management.commands.update_prices import Command as UpdatePricesCommand
+from games.models import Game
+from games.sync_jobs import LEASE_SECONDS, claim_job, complete_job, fail_job, heartbeat
+from games.sync_stats import get_batch_run, save_stats
+
+
+class Command(UpdatePricesCommand):
+    help = 'Process affiliate sync jobs from the database job queue, see sync_coordinator'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        # The options of update_prices are taken from the batch of a job, unless given to the worker
+        parser.set_defaults(stale_offers=None)
+        parser.add_argument(
+            '--worker_id',
+            default=f'{socket.gethostname()}-{os.getpid()}',
+            help='Name of this worker, defaults to the host name and process id',
+        )
+        parser.add_argument(
+            '--wait',
+            action='store_true',
+            help='Keep waiting for new jobs instead of stopping when there are no jobs available',
+        )
+        parser.add_argument(
+            '--poll_interval',
+            type=float,
+            default=5,
+            help='Seconds between checks for new jobs when waiting',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=LEASE_SECONDS,
+            help='Seconds a job stays claimed without heartbeat, heartbeats are sent three times per lease',
+        )
+
+    def handle(self, *args, **options):
+        if options['use_async']:
+            raise CommandError("sync_worker doesn't support --async, start more workers to sync affiliates concurrently")
+
+        self.options = options
+        worker_id = options['worker_id']
+        self.stdout.write(f"Sync worker {worker_id} started")
+
+        processed = 0
+        while True:
+            job = claim_job(worker_id, options['lease'])
+            if not job:
+                if not options['wait']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.run_job(job, options['lease'])
+            processed += 1
+
+        self.stdout.write(f"Sync worker {worker_id} stopped, processed {processed} jobs")
+
+    def run_job(self, job, lease_seconds):
+        affiliate = job.affiliate
+        batch = job.batch
+        self.stale_offers = self.options['stale_offers'] or batch.stale_offers
+        self.use_feed_cache = batch.use_feed_cache and not self.options['no_cache']
+        use_sample_data = batch.use_sample_data or self.options['use_sample_data']
+        self.stdout.write(f"---")
+        self.stdout.write(f"Processing {affiliate.name} ({affiliate.program}), attempt {job.attempts}...")
+
+        # Extend the lease while the job runs, so other workers don't claim it
+        stop_heartbeat = threading.Event()
+
+        def send_heartbeats():
+            try:
+                while not stop_heartbeat.wait(lease_seconds / 3):
+                    try:
+                        claimed = heartbeat(job, lease_seconds)
+                    except DatabaseError as e:
+                        # E.g. a locked database, the lease lasts three heartbeats so try again on the next one
+                        self.stderr.write(f"Heartbeat for {affiliate.name} failed: {e}")
+                        continue
+                    if not claimed:
+                        self.stderr.write(f"Lost the lease on {affiliate.name} to another worker")
+                        break
+            finally:
+                # The heartbeat thread uses its own database connection
+                connection.close()
+
+        heartbeat_thread = threading.Thread(target=send_heartbeats, daemon=True)
+        heartbeat_thread.start()
+
+        try:
+            game_eans = set(Game.objects.values_list('ean', flat=True))
+            content = self.fetch_feed_content(affiliate, use_sample_data)
+            game_data = self.parse_feed_content(affiliate, content, game_eans) if content else None
+            created_count, updated_count = self.update_affiliate_games(affiliate, game_data)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            self.stderr.write(f"Error processing {affiliate.name}: {error}")
+            self.affiliate_stat(affiliate).error = error
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+            fail_job(job, error)
+        else:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+            if not complete_job(job, created_count, updated_count):
+                self.stderr.write(f"Job for {affiliate.name} was claimed by another worker, result not recorded")
+
+        # Every attempt is recorded in the run of the batch
+        save_stats(get_batch_run(job.batch), [self.sync_stats.pop(affiliate.pk)])
@@ -1,56 +1,154 @@
 # your_app/management/commands/update_prices.py
 
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from games.management.commands.affiliate_async_runner import run_affiliate_pipeline
 from games.management.commands.affiliate_command_base import AffiliateCommandBase
 from games.models import Affiliate, AffiliateGame, Game, AffiliateCategory  # Update with your actual models
+from games.sync_stats import finish_run, save_stats, start_run
+
+# Fields of AffiliateGame that are written from the feeds
+WRITE_FIELDS = ('price', 'effective_price_nl', 'effective_price_be', 'stock', 'description', 'category_id', 'image', 'link')
+
+# Number of offers per insert or update statement
+WRITE_BATCH_SIZE = 500
 
+# What to do with stored offers of games that are no longer in the affiliate's feed
+STALE_OFFERS_ZERO = 'zero'  # Set the stock to 0, so the offer isn't shown anymore
+STALE_OFFERS_DELETE = 'delete'
+STALE_OFFERS_KEEP = 'keep'
 
 
 class Command(AffiliateCommandBase):
     help = 'Update prices for affiliate games from CSV data'
+    stale_offers = STALE_OFFERS_ZERO
 
     def add_arguments(self, parser):
+        super().add_arguments(parser)
         parser.add_argument(
-            '--use_sample_data',
-            action='store_true',
-            help='Use sample data instead of fetching from actual URLs',
+            '--stale_offers',
+            choices=[STALE_OFFERS_ZERO, STALE_OFFERS_DELETE, STALE_OFFERS_KEEP],
+            default=STALE_OFFERS_ZERO,
+            help='What to do with offers of games that are no longer in the feed: set their stock to 0 (default), '
+                 'delete them or keep them as they are',
         )
 
     def handle(self, *args, **kwargs):
         self.stdout.write("Starting price update for affiliates...")
+        self.stale_offers = kwargs.get('stale_offers') or STALE_OFFERS_ZERO
+        run = start_run('update_prices', bool(kwargs.get('use_sample_data')))
 
         affiliates = Affiliate.objects.filter(enabled=True)  # Get only enabled affiliates
         game_eans = set(Game.objects.values_list('ean', flat=True))  # Fetch all EANs
-        total_updated = 0
-
-        for affiliate in affiliates:
-            self.stdout.write(f"---")
-            self.stdout.write(f"Processing {affiliate.name} ({affiliate.program})...")
-            game_data = self.process_affiliate(affiliate, kwargs.get('use_sample_data'), game_eans)
-            affiliate_categories_dict = {category.name: category for category in AffiliateCategory.objects.filter(affiliate=affiliate)}
-
-            created_count = 0
-            updated_count = 0
-            for game in game_data:
-                ag, created = AffiliateGame.objects.update_or_create(
-                    affiliate=affiliate,
-                    game_id=game.ean,
-                    defaults={
-                        'price': game.price,
-                        'stock': game.stock if game.price else 0,
-                        'description': game.description,
-                        'category': affiliate_categories_dict.get(game.category, None),
-                        'image': game.image,
-                        'link': game.link
-                    }
-                )
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
-
-            self.stdout.write(f'Updated prices from {affiliate.name} for {updated_count} games, added price for {created_count} games\n')
-
-            total_updated += updated_count
+
+        if kwargs.get('use_async'):
+            results = run_affiliate_pipeline(
+                self, affiliates, kwargs.get('use_sample_data'), self.update_affiliate_games, game_eans)
+        else:
+            results = []
+            for affiliate in affiliates:
+                self.stdout.write(f"---")
+                self.stdout.write(f"Processing {affiliate.name} ({affiliate.program})...")
+                game_data = self.process_affiliate(affiliate, kwargs.get('use_sample_data'), game_eans)
+                results.append(self.update_affiliate_games(affiliate, game_data))
+
+        save_stats(run, self.sync_stats.values())
+        finish_run(run)
+
+        total_updated = sum(updated_count for created_count, updated_count in results)
 
         self.stdout.write(f'---')
         self.stdout.write(f'Completed price update for all affiliates, total of {total_updated} prices updated.')
+
+        call_command('detect_deals', stdout=self.stdout, stderr=self.stderr)
+
+    def update_affiliate_games(self, affiliate, game_data):
+        """
+        Store the parsed game data of an affiliate, returns a tuple of (created_count, updated_count).
+
+        The offers are compared with the stored ones and only new and changed offers are written,
+        in bulk and in a single short transaction per affiliate. Stored offers of games that are no
+        longer in the feed are expired, see `stale_offers`.
+
+        :param game_data: The parsed feed, or None if the feed could not be processed. In that case
+            the stored offers are left alone.
+        """
+        if game_data is None:
+            self.stdout.write(f'No prices updated from {affiliate.name}, keeping its stored prices\n')
+            return 0, 0
+
+        affiliate_categories_dict = {category.name: category.pk for category in AffiliateCategory.objects.filter(affiliate=affiliate)}
+
+        # The values per game, a feed can list a game more than once in which case the last one is used
+        offers = {}
+        for game in game_data:
+            offers[game.ean] = {
+                'price': game.price,
+                'effective_price_nl': affiliate.effective_price_nl(game.price),
+                'effective_price_be': affiliate.effective_price_be(game.price),
+                'stock': game.stock if game.price else 0,
+                'description': game.description,
+                'category_id': affiliate_categories_dict.get(game.category, None),
+                'image': game.image,
+                'link': game.link
+            }
+
+        with self.timed(affiliate, 'write_seconds') as stat, transaction.atomic():
+            existing_games = {ag.game_id: ag for ag in AffiliateGame.objects.filter(affiliate=affiliate)}
+
+            # Count every row like separate updates would, the first row of a new game adds it
+            created_count = len(offers.keys() - existing_games.keys())
+            updated_count = len(game_data) - created_count
+
+            new_games = []
+            changed_games = []
+            now = timezone.now()
+            for ean, values in offers.items():
+                ag = existing_games.get(ean)
+                if ag is None:
+                    new_games.append(AffiliateGame(affiliate=affiliate, game_id=ean, **values))
+                elif any(getattr(ag, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(ag, field, value)
+                    # bulk_update doesn't set auto_now fields
+                    ag.updated_at = now
+                    changed_games.append(ag)
+
+            AffiliateGame.objects.bulk_create(new_games, batch_size=WRITE_BATCH_SIZE)
+            AffiliateGame.objects.bulk_update(changed_games, list(WRITE_FIELDS) + ['updated_at'], batch_size=WRITE_BATCH_SIZE)
+
+            stale_ids = [ag.pk for ean, ag in existing_games.items() if ean not in offers]
+            if stale_ids and not offers:
+                # Most likely a broken feed rather than an affiliate that sells none of our games
+                self.stderr.write(f"No games found in the feed of {affiliate.name}, not expiring its stored prices")
+            elif stale_ids:
+                stat.rows_expired = self.expire_offers(stale_ids)
+                if stat.rows_expired:
+                    self.stdout.write(f'Expired {stat.rows_expired} prices from {affiliate.name} that are no longer in its feed')
+
+            stat.rows_created = len(new_games)
+            stat.rows_changed = len(changed_games)
+            stat.rows_unchanged = len(offers) - len(new_games) - len(changed_games)
+
+        self.stdout.write(f'Updated prices from {affiliate.name} for {updated_count} games, added price for {created_count} games\n')
+
+        return created_count, updated_count
+
+    def expire_offers(self, stale_ids):
+        """
+        Expires the offers with the given ids according to `stale_offers`, returns the number of expired offers.
+        """
+        if self.stale_offers == STALE_OFFERS_KEEP:
+            return 0
+
+        expired_count = 0
+        for start in range(0, len(stale_ids), WRITE_BATCH_SIZE):
+            stale_games = AffiliateGame.objects.filter(pk__in=stale_ids[start:start + WRITE_BATCH_SIZE])
+            if self.stale_offers == STALE_OFFERS_DELETE:
+                expired_count += stale_games.delete()[0]
+            else:
+                # Offers that are already out of stock don't need to change
+                expired_count += stale_games.filter(stock__gt=0).update(stock=0, updated_at=timezone.now())
+        return expired_count
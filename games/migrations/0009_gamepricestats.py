@@ -0,0 +1,31 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0008_syncbatch_syncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GamePriceStats',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='price_stats', serialize=False, to='games.game')),
+                ('offer_count', models.IntegerField(default=0)),
+                ('lowest_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('median_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('highest_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('discount', models.DecimalField(decimal_places=1, default=0, max_digits=4)),
+                ('is_deal', models.BooleanField(db_index=True, default=False)),
+                ('is_price_drop', models.BooleanField(db_index=True, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'game price stats',
+            },
+        ),
+    ]
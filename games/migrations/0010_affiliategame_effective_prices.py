@@ -0,0 +1,73 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+def compute_effective_prices(apps, schema_editor):
+    # A copy of games.models.effective_price_expression, as it may change after this migration
+    def effective_price_expression(shipping, free_shipping_from):
+        price_with_shipping = models.ExpressionWrapper(
+            models.F('price') + models.Value(shipping), output_field=models.DecimalField(max_digits=7, decimal_places=2))
+        if not free_shipping_from:
+            return price_with_shipping
+        return models.Case(
+            models.When(price__gte=free_shipping_from, then=models.F('price')),
+            default=price_with_shipping,
+        )
+
+    Affiliate = apps.get_model('games', 'Affiliate')
+    AffiliateGame = apps.get_model('games', 'AffiliateGame')
+    for affiliate in Affiliate.objects.all():
+        AffiliateGame.objects.filter(affiliate=affiliate).update(
+            effective_price_nl=effective_price_expression(affiliate.shipping_nl, affiliate.free_shipping_nl),
+            effective_price_be=effective_price_expression(affiliate.shipping_be, affiliate.free_shipping_be),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0009_gamepricestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='affiliategame',
+            name='effective_price_be',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=7),
+        ),
+        migrations.AddField(
+            model_name='affiliategame',
+            name='effective_price_nl',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=7),
+        ),
+        migrations.RunPython(compute_effective_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='affiliategame',
+            index=models.Index(fields=['game', 'effective_price_nl'], name='games_affil_game_id_86ebe0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='affiliategame',
+            index=models.Index(fields=['game', 'effective_price_be'], name='games_affil_game_id_71d840_idx'),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='last_lowest_price',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=7),
+        ),
+        migrations.AlterField(
+            model_name='gamepricestats',
+            name='highest_price',
+            field=models.DecimalField(decimal_places=2, max_digits=7),
+        ),
+        migrations.AlterField(
+            model_name='gamepricestats',
+            name='lowest_price',
+            field=models.DecimalField(decimal_places=2, max_digits=7),
+        ),
+        migrations.AlterField(
+            model_name='gamepricestats',
+            name='median_price',
+            field=models.DecimalField(decimal_places=2, max_digits=7),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0010_affiliategame_effective_prices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('use_sample_data', models.BooleanField(default=False)),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('batch', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sync_run', to='games.syncbatch')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AffiliateSyncStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('error', models.TextField(blank=True, default='')),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('rows_scanned', models.IntegerField(blank=True, null=True)),
+                ('rows_matched', models.IntegerField(default=0)),
+                ('rows_created', models.IntegerField(default=0)),
+                ('rows_changed', models.IntegerField(default=0)),
+                ('rows_unchanged', models.IntegerField(default=0)),
+                ('rows_expired', models.IntegerField(default=0)),
+                ('from_cache', models.BooleanField(default=False)),
+                ('download_seconds', models.FloatField(default=0)),
+                ('parse_seconds', models.FloatField(default=0)),
+                ('write_seconds', models.FloatField(default=0)),
+                ('affiliate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_stats', to='games.affiliate')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='affiliate_stats', to='games.syncrun')),
+            ],
+        ),
+    ]
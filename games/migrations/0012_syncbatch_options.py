@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0011_syncrun_affiliatesyncstat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncbatch',
+            name='stale_offers',
+            field=models.CharField(default='zero', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='syncbatch',
+            name='use_feed_cache',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,6 +1,8 @@
 import html
-from bs4 import BeautifulSoup
+from decimal import Decimal
+
 from django.db import models
+from django.utils import timezone
 
 
 class Game(models.Model):
@@ -8,7 +10,8 @@ class Game(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
     new = models.BooleanField(default=True)
-    last_lowest_price = models.DecimalField(max_digits=6, decimal_places=2, default=0.0)
+    last_lowest_price = models.DecimalField(max_digits=7, decimal_places=2, default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} (EAN: {self.ean})"
@@ -23,14 +26,40 @@ class Game(models.Model):
 
     @property
     def available_game_affiliates(self):
-        return self.affiliate_games.filter(stock__gt=0).order_by('price')
+        return self.affiliate_games.filter(stock__gt=0).order_by('effective_price_nl')
 
     @property
     def clean_description(self):
+        # Imported here, BeautifulSoup is slow to import and only needed when rendering descriptions
+        from bs4 import BeautifulSoup
+
         # Use BeautifulSoup to remove HTML tags and just keep the plain text
         return BeautifulSoup(html.unescape(self.description), 'html.parser').get_text().replace("\\n", " ")
 
 
+def effective_price(price: Decimal, shipping: Decimal, free_shipping_from: Decimal) -> Decimal:
+    """
+    Returns the price including shipping, shipping is free from `free_shipping_from` (if it's set).
+    """
+    if free_shipping_from and price >= free_shipping_from:
+        return price
+    return price + shipping
+
+
+def effective_price_expression(shipping: Decimal, free_shipping_from: Decimal):
+    """
+    Database expression of effective_price for the price of an AffiliateGame.
+    """
+    price_with_shipping = models.ExpressionWrapper(
+        models.F('price') + models.Value(shipping), output_field=models.DecimalField(max_digits=7, decimal_places=2))
+    if not free_shipping_from:
+        return price_with_shipping
+    return models.Case(
+        models.When(price__gte=free_shipping_from, then=models.F('price')),
+        default=price_with_shipping,
+    )
+
+
 class Affiliate(models.Model):
 
     class Program(models.TextChoices):
@@ -52,9 +81,38 @@ class Affiliate(models.Model):
     free_shipping_be = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     shipping_note = models.CharField(max_length=100, blank=True, default='')
 
+    # Fields the effective prices of the affiliate's games depend on
+    SHIPPING_FIELDS = ('shipping_nl', 'shipping_be', 'free_shipping_nl', 'free_shipping_be')
+
     def __str__(self):
         return f"{self.name} ({self.program})"
 
+    def save(self, *args, **kwargs):
+        stored_shipping = None
+        update_fields = kwargs.get('update_fields')
+        if self.pk and (update_fields is None or set(update_fields) & set(self.SHIPPING_FIELDS)):
+            stored_shipping = Affiliate.objects.filter(pk=self.pk).values_list(*self.SHIPPING_FIELDS).first()
+        super().save(*args, **kwargs)
+        if stored_shipping is not None and stored_shipping != tuple(getattr(self, field) for field in self.SHIPPING_FIELDS):
+            self.update_effective_prices()
+
+    def effective_price_nl(self, price: Decimal) -> Decimal:
+        return effective_price(price, self.shipping_nl, self.free_shipping_nl)
+
+    def effective_price_be(self, price: Decimal) -> Decimal:
+        return effective_price(price, self.shipping_be, self.free_shipping_be)
+
+    def update_effective_prices(self):
+        """
+        Recomputes the effective prices of all games of the affiliate in a single statement,
+        after its shipping costs changed.
+        """
+        return self.games.update(
+            effective_price_nl=effective_price_expression(self.shipping_nl, self.free_shipping_nl),
+            effective_price_be=effective_price_expression(self.shipping_be, self.free_shipping_be),
+            updated_at=timezone.now(),
+        )
+
     @property
     def game_count(self):
         return self.games.count()
@@ -76,6 +134,10 @@ class AffiliateCategory(models.Model):
 class AffiliateGame(models.Model):
     class Meta:
         unique_together = ('affiliate', 'game')
+        indexes = [
+            models.Index(fields=['game', 'effective_price_nl']),
+            models.Index(fields=['game', 'effective_price_be']),
+        ]
 
     affiliate = models.ForeignKey(Affiliate, on_delete=models.CASCADE, related_name='games')
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='affiliate_games')
@@ -84,11 +146,167 @@ class AffiliateGame(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    # Price including shipping to the Netherlands and Belgium, computed when the offer or its affiliate is saved
+    effective_price_nl = models.DecimalField(max_digits=7, decimal_places=2, default=0)
+    effective_price_be = models.DecimalField(max_digits=7, decimal_places=2, default=0)
     stock_r = models.TextField(blank=True, default='')
     stock = models.IntegerField(default=0)
     tags = models.CharField(max_length=1000, blank=True, default='')
     image = models.URLField(max_length=800, blank=True, default='')
     link = models.URLField(max_length=800, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} - {self.affiliate.name} (Price: {self.price})"
+
+    def save(self, *args, **kwargs):
+        # The feeds write offers with bulk_create and bulk_update, which compute the effective prices themselves
+        self.update_effective_prices()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'effective_price_nl', 'effective_price_be'}
+        super().save(*args, **kwargs)
+
+    def update_effective_prices(self):
+        self.effective_price_nl = self.affiliate.effective_price_nl(self.price)
+        self.effective_price_be = self.affiliate.effective_price_be(self.price)
+
+
+class GamePriceStats(models.Model):
+    """
+    Statistics of the in stock offers of a game, computed for all games at once by games.deals after every sync.
+    """
+    game = models.OneToOneField(Game, on_delete=models.CASCADE, primary_key=True, related_name='price_stats')
+    offer_count = models.IntegerField(default=0)
+    lowest_price = models.DecimalField(max_digits=7, decimal_places=2)
+    median_price = models.DecimalField(max_digits=7, decimal_places=2)
+    highest_price = models.DecimalField(max_digits=7, decimal_places=2)
+    # Percentage the lowest price is below the median price
+    discount = models.DecimalField(max_digits=4, decimal_places=1, default=0)
+    is_deal = models.BooleanField(default=False, db_index=True)
+    # The lowest price dropped below the last exported lowest price
+    is_price_drop = models.BooleanField(default=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'game price stats'
+
+    def __str__(self):
+        return f"Price stats of {self.game_id}"
+
+    @property
+    def price_spread(self):
+        return self.highest_price - self.lowest_price
+
+
+class SyncBatch(models.Model):
+    """
+    A sync of all enabled affiliates, processed as one SyncJob per affiliate by the sync workers.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    use_sample_data = models.BooleanField(default=False)
+    # Options of update_prices the workers process the jobs with
+    stale_offers = models.CharField(max_length=20, default='zero')
+    use_feed_cache = models.BooleanField(default=True)
+    exported_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Sync batch {self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
+
+    @property
+    def is_finished(self):
+        return not self.jobs.filter(status__in=SyncJob.ACTIVE_STATUSES).exists()
+
+
+class SyncJob(models.Model):
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+        SKIPPED = 'skipped', 'Skipped'
+
+    ACTIVE_STATUSES = (Status.PENDING, Status.RUNNING)
+
+    batch = models.ForeignKey(SyncBatch, on_delete=models.CASCADE, related_name='jobs')
+    affiliate = models.ForeignKey(Affiliate, on_delete=models.CASCADE, related_name='sync_jobs')
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, db_index=True)
+
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    lease_owner = models.CharField(max_length=100, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.affiliate.name} ({self.get_status_display()})"
+
+
+class SyncRun(models.Model):
+    """
+    A run of update_prices, or a batch of the sync workers, with an AffiliateSyncStat per affiliate.
+    """
+    command = models.CharField(max_length=50)
+    batch = models.OneToOneField(SyncBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='sync_run')
+    use_sample_data = models.BooleanField(default=False)
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Sync run {self.pk} ({self.started_at:%Y-%m-%d %H:%M})"
+
+    @property
+    def duration(self):
+        if self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+        return None
+
+
+class AffiliateSyncStat(models.Model):
+    """
+    What a sync run did for one affiliate: the size of its feed, the rows that were matched and
+    written, and how long every stage took.
+    """
+    run = models.ForeignKey(SyncRun, on_delete=models.CASCADE, related_name='affiliate_stats')
+    affiliate = models.ForeignKey(Affiliate, on_delete=models.CASCADE, related_name='sync_stats')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    error = models.TextField(blank=True, default='')
+
+    bytes_downloaded = models.BigIntegerField(default=0)
+    # Lines read from the feed, None when the parse result was cached
+    rows_scanned = models.IntegerField(null=True, blank=True)
+    rows_matched = models.IntegerField(default=0)
+    rows_created = models.IntegerField(default=0)
+    rows_changed = models.IntegerField(default=0)
+    rows_unchanged = models.IntegerField(default=0)
+    rows_expired = models.IntegerField(default=0)
+    from_cache = models.BooleanField(default=False)
+
+    download_seconds = models.FloatField(default=0)
+    parse_seconds = models.FloatField(default=0)
+    write_seconds = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.affiliate.name} in {self.run}"
+
+    @property
+    def failed(self):
+        return bool(self.error)
+
+    @property
+    def duration(self):
+        return self.download_seconds + self.parse_seconds + self.write_seconds
+
+    @property
+    def throughput(self):
+        """
+        Bytes of the feed processed per second, over all stages.
+        """
+        return self.bytes_downloaded / self.duration if self.duration else 0
@@ -0,0 +1,114 @@
+import re
+from decimal import Decimal, ROUND_HALF_EVEN
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+# Prices without thousands separator and with exactly two decimals, like "12.99" or "12,99"
+_SIMPLE_PRICE_RE = re.compile(r'(\d+)([.,])(\d\d)')
+
+# Anything that isn't part of the number, like currency symbols, codes and whitespace
+_NOISE_RE = re.compile(r'[^\d.,\-]+')
+
+# A price with optional thousands separators and up to two decimals, e.g. "1.234,56", "1,234.5" or "12,99".
+# The decimal separator must differ from the thousands separator.
+_PRICE_RE = re.compile(r'''
+    (?P<sign>-)?
+    (?P<units>\d{1,3}(?P<sep>[.,])\d{3}(?:(?P=sep)\d{3})*|\d+)
+    (?:(?!(?P=sep))[.,](?P<fraction>\d{1,2}))?
+''', re.VERBOSE)
+
+# A price with a known decimal separator and no thousands separators, with any number of decimals
+_DECIMAL_PRICE_RE = re.compile(r'(?P<sign>-)?(?P<units>\d*)(?:(?P<sep>[.,])(?P<fraction>\d+))?')
+
+CENTS = Decimal('0.01')
+
+
+def _fraction_cents(fraction: str) -> int:
+    if len(fraction) <= 2:
+        return int(fraction.ljust(2, '0'))
+    # More precision than cents, rounded like DecimalField does when the price is saved
+    return int(Decimal(f'0.{fraction}').quantize(CENTS, ROUND_HALF_EVEN) * 100)
+
+
+@lru_cache(maxsize=4096)
+def parse_price_cents(value: str, decimal_separators: Optional[str] = None,
+                      thousands_separators: Optional[str] = None) -> int:
+    """
+    Parses a price string into an integer amount of cents, e.g. "1.234,56" -> 123456.
+
+    Currency symbols and codes ("12,99 EUR", "€ 12.99") are ignored and an empty value is parsed as 0.
+
+    :param decimal_separators: The decimal separator(s) of the value, e.g. "." for a feed column with prices
+        like "12.99" or "12.990". The value can't have thousands separators then, unless they're given as
+        well, and decimals beyond cents are rounded. When not given, the separators are derived from the
+        value: both a comma and a dot are accepted as decimal separator with up to two decimals, and
+        thousands separators are allowed.
+    :param thousands_separators: The thousands separator(s) of the value, removed before it's parsed, e.g.
+        "." with decimal separator "," for Dutch prices like "1.299" or "1.299,00". Requires decimal_separators.
+    :raises ValueError: If the value isn't a valid price, or when the separators are derived and a single
+        separator is followed by three digits ("1.234" or "12.990"), which is ambiguous.
+    """
+    if thousands_separators:
+        if not decimal_separators or set(thousands_separators) & set(decimal_separators):
+            raise ValueError("Thousands separators need different decimal separators")
+        value = value.translate(str.maketrans('', '', thousands_separators))
+
+    if value.isdigit():
+        return int(value) * 100
+
+    match = _SIMPLE_PRICE_RE.fullmatch(value)
+    if match and (decimal_separators is None or match[2] in decimal_separators):
+        return int(match[1]) * 100 + int(match[3])
+
+    cleaned = _NOISE_RE.sub('', value)
+    if not cleaned:
+        if value.strip():
+            raise ValueError(f"Invalid price format: {value}")
+        return 0
+
+    if decimal_separators is not None:
+        match = _DECIMAL_PRICE_RE.fullmatch(cleaned)
+        if not match or not (match['units'] or match['fraction']) or \
+                (match['sep'] and match['sep'] not in decimal_separators):
+            raise ValueError(f"Invalid price format: {value}")
+        cents = int(match['units'] or '0') * 100 + _fraction_cents(match['fraction'] or '')
+        return -cents if match['sign'] else cents
+
+    match = _PRICE_RE.fullmatch(cleaned)
+    if not match:
+        raise ValueError(f"Invalid price format: {value}")
+
+    units = match['units']
+    if match['sep']:
+        if not match['fraction'] and units.count(match['sep']) == 1:
+            raise ValueError(f"Ambiguous price format, thousands or decimal separator: {value}")
+        units = units.replace(match['sep'], '')
+    cents = int(units) * 100 + int((match['fraction'] or '0').ljust(2, '0'))
+    return -cents if match['sign'] else cents
+
+
+def parse_price(value, decimal_separators: Optional[str] = None, thousands_separators: Optional[str] = None) -> Decimal:
+    """
+    Parses a price string into a Decimal with two decimal places, see parse_price_cents.
+    """
+    if not value:
+        return Decimal('0.00')
+    return Decimal(parse_price_cents(value, decimal_separators, thousands_separators)).scaleb(-2)
+
+
+def parse_prices(values: Iterable[str], decimal_separators: Optional[str] = None,
+                 thousands_separators: Optional[str] = None) -> List[Decimal]:
+    """
+    Parses a batch of price strings, see parse_price_cents.
+
+    Feeds repeat the same prices a lot, so every distinct value is only parsed once.
+    """
+    parsed = {}
+    result = []
+    append = result.append
+    for value in values:
+        price = parsed.get(value)
+        if price is None:
+            price = parsed[value] = parse_price(value, decimal_separators, thousands_separators)
+        append(price)
+    return result
@@ -0,0 +1,139 @@
+from datetime import timedelta
+from typing import Optional
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from games.models import Affiliate, SyncBatch, SyncJob
+
+# Seconds a worker may hold a job without sending a heartbeat, after that another worker can claim it
+LEASE_SECONDS = 300
+
+# Number of times a job is tried before it's marked as failed
+MAX_ATTEMPTS = 3
+
+# Seconds to wait before a failed job is tried again, multiplied by the number of attempts
+RETRY_DELAY = 60
+
+
+def create_batch(use_sample_data=False, min_interval=None, stale_offers='zero', use_feed_cache=True) -> SyncBatch:
+    """
+    Creates a batch with a job for every enabled affiliate.
+
+    :param use_sample_data: Use sample data instead of fetching from actual URLs.
+    :param min_interval: Optional timedelta, affiliates that were synced within this interval are skipped.
+    :param stale_offers: What the workers do with offers no longer in a feed, see update_prices.
+    :param use_feed_cache: Whether the workers may use a cached parse result of an identical feed.
+    """
+    now = timezone.now()
+    batch = SyncBatch.objects.create(
+        use_sample_data=use_sample_data, stale_offers=stale_offers, use_feed_cache=use_feed_cache)
+
+    recently_synced = set()
+    if min_interval:
+        recently_synced = set(SyncJob.objects.filter(
+            status=SyncJob.Status.DONE,
+            finished_at__gte=now - min_interval,
+        ).values_list('affiliate_id', flat=True))
+
+    SyncJob.objects.bulk_create([
+        SyncJob(
+            batch=batch,
+            affiliate=affiliate,
+            status=SyncJob.Status.SKIPPED if affiliate.pk in recently_synced else SyncJob.Status.PENDING,
+            available_at=now,
+        )
+        for affiliate in Affiliate.objects.filter(enabled=True)
+    ])
+    return batch
+
+
+def fail_expired_jobs(max_attempts=MAX_ATTEMPTS):
+    """
+    Marks running jobs as failed when their lease expired and they can't be tried again.
+    """
+    return SyncJob.objects.filter(
+        status=SyncJob.Status.RUNNING,
+        lease_expires_at__lt=timezone.now(),
+        attempts__gte=max_attempts,
+    ).update(status=SyncJob.Status.FAILED, lease_owner='', finished_at=timezone.now(),
+             last_error='Lease expired, the worker stopped sending heartbeats')
+
+
+def claim_job(worker_id: str, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS) -> Optional[SyncJob]:
+    """
+    Claims the next available job for `worker_id`, returns None if there is no job available.
+
+    A job is available when it's pending, or when it's running but its lease expired because the
+    worker that claimed it stopped. Claiming is a conditional update on the attempt counter, so when
+    multiple workers try to claim the same job only one succeeds, on any database.
+    """
+    fail_expired_jobs(max_attempts)
+
+    while True:
+        now = timezone.now()
+        available = (
+            Q(status=SyncJob.Status.PENDING, available_at__lte=now) |
+            Q(status=SyncJob.Status.RUNNING, lease_expires_at__lt=now, attempts__lt=max_attempts)
+        )
+        candidates = SyncJob.objects.filter(available).order_by('available_at', 'pk').values_list('pk', 'attempts')[:10]
+        candidates = list(candidates)
+        if not candidates:
+            return None
+
+        for job_id, attempts in candidates:
+            # The job must still be available, it may have been released for a retry later in the meantime
+            claimed = SyncJob.objects.filter(available, pk=job_id, attempts=attempts).update(
+                status=SyncJob.Status.RUNNING,
+                attempts=F('attempts') + 1,
+                lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now,
+                started_at=now,
+                last_error='',
+            )
+            if claimed:
+                return SyncJob.objects.select_related('batch', 'affiliate').get(pk=job_id)
+        # All candidates were claimed by other workers, try the next ones
+
+
+def _owned_job(job: SyncJob):
+    return SyncJob.objects.filter(pk=job.pk, status=SyncJob.Status.RUNNING, lease_owner=job.lease_owner)
+
+
+def heartbeat(job: SyncJob, lease_seconds=LEASE_SECONDS) -> bool:
+    """
+    Extends the lease of a claimed job, returns False if the worker lost the job to another worker.
+    """
+    now = timezone.now()
+    return bool(_owned_job(job).update(heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds)))
+
+
+def complete_job(job: SyncJob, created_count: int, updated_count: int) -> bool:
+    return bool(_owned_job(job).update(
+        status=SyncJob.Status.DONE,
+        lease_owner='',
+        finished_at=timezone.now(),
+        created_count=created_count,
+        updated_count=updated_count,
+    ))
+
+
+def fail_job(job: SyncJob, error: str, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY) -> bool:
+    """
+    Releases a job that failed, it's tried again later unless it reached the maximum number of attempts.
+    """
+    now = timezone.now()
+    if job.attempts < max_attempts:
+        return bool(_owned_job(job).update(
+            status=SyncJob.Status.PENDING,
+            lease_owner='',
+            available_at=now + timedelta(seconds=retry_delay * job.attempts),
+            last_error=error,
+        ))
+    return bool(_owned_job(job).update(
+        status=SyncJob.Status.FAILED,
+        lease_owner='',
+        finished_at=now,
+        last_error=error,
+    ))
@@ -0,0 +1,81 @@
+from statistics import median
+from typing import Iterable, List, Tuple
+
+from django.utils import timezone
+
+from games.models import Affiliate, AffiliateSyncStat, SyncBatch, SyncRun
+
+# Number of earlier syncs of an affiliate its latest sync is compared with
+BASELINE_WINDOW = 10
+
+# Minimum number of successful earlier syncs needed to compare with
+MIN_BASELINE_SYNCS = 3
+
+# A sync deviates when its throughput is below, or its matched rows are outside, this fraction of the baseline
+DEVIATION_THRESHOLD = 0.5
+
+
+def start_run(command: str, use_sample_data=False) -> SyncRun:
+    return SyncRun.objects.create(command=command, use_sample_data=use_sample_data)
+
+
+def get_batch_run(batch: SyncBatch) -> SyncRun:
+    """
+    Returns the run of a batch of the sync workers, the first worker that finishes a job creates it.
+    """
+    run, _ = SyncRun.objects.get_or_create(batch=batch, defaults={
+        'command': 'sync_coordinator',
+        'use_sample_data': batch.use_sample_data,
+        'started_at': batch.created_at,
+    })
+    return run
+
+
+def finish_run(run: SyncRun):
+    run.finished_at = timezone.now()
+    run.save(update_fields=['finished_at'])
+
+
+def save_stats(run: SyncRun, stats: Iterable[AffiliateSyncStat]):
+    stats = list(stats)
+    for stat in stats:
+        stat.run = run
+    AffiliateSyncStat.objects.bulk_create(stats)
+
+
+def find_regressions(window=BASELINE_WINDOW, min_syncs=MIN_BASELINE_SYNCS,
+                     threshold=DEVIATION_THRESHOLD) -> List[Tuple[Affiliate, str]]:
+    """
+    Compares the latest sync of every enabled affiliate with the median of its earlier successful syncs,
+    returns a list of (affiliate, problem) tuples for the affiliates whose sync failed, became much slower
+    or matched a very different number of rows.
+
+    Throughput is only compared with syncs that also did (or didn't) use a cached parse result, as
+    those are much faster.
+    """
+    regressions = []
+    for affiliate in Affiliate.objects.filter(enabled=True).order_by('name'):
+        stats = list(affiliate.sync_stats.order_by('-created_at')[:window + 1])
+        if not stats:
+            continue
+        latest, earlier = stats[0], stats[1:]
+        if latest.failed:
+            regressions.append((affiliate, f"sync failed: {latest.error}"))
+            continue
+
+        baseline = [stat for stat in earlier if not stat.failed]
+        if len(baseline) < min_syncs:
+            continue
+
+        matched_baseline = median(stat.rows_matched for stat in baseline)
+        if not matched_baseline * threshold <= latest.rows_matched <= matched_baseline / threshold:
+            regressions.append((affiliate, f"matched {latest.rows_matched} rows, "
+                                           f"usually {matched_baseline:.0f}"))
+
+        throughput_baseline = [stat.throughput for stat in baseline if stat.from_cache == latest.from_cache]
+        if len(throughput_baseline) >= min_syncs:
+            throughput_median = median(throughput_baseline)
+            if latest.throughput < throughput_median * threshold:
+                regressions.append((affiliate, f"processed {latest.throughput / 1024:.0f} KB/s, "
+                                               f"usually {throughput_median / 1024:.0f} KB/s"))
+    return regressions
@@ -0,0 +1,15 @@
+from django import template
+
+from games.formatting import format_price
+
+register = template.Library()
+
+
+@register.filter
+def price_nl(value):
+    """
+    Formats a price the Dutch way, e.g. {{ 12.5|price_nl }} -> 12,50
+    """
+    if value is None or value == '':
+        return ''
+    return format_price(value)
@@ -1,3 +1,930 @@
-from django.test import TestCase
+import csv
+import hashlib
+import json
+import locale
+import os
+import pickle
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import models
+from django.db.backends.utils import format_number
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from games.deals import update_price_stats
+from games.exports import export_etag, update_last_lowest_prices
+from games.management.commands.affiliate_command_base import (
+    AFFILIATE_PARSERS, Column, FeedParser, parse_ean, parse_int,
+)
+from games.management.commands.affiliate_feed_cache import CACHE_FORMAT_VERSION, FeedCache, hash_game_eans
+from games.management.commands.affiliate_feed_reader import (
+    SNIFF_SIZE, iter_feed_lines, map_feed_file, sniff_feed_delimiter,
+)
+from games.formatting import format_price
+from games.models import (
+    Affiliate, AffiliateCategory, AffiliateGame, AffiliateSyncStat, Game, GamePriceStats, SyncJob,
+)
+from games.pricing import parse_price
+from games.sync_jobs import claim_job, create_batch, fail_job, heartbeat
+
+
+def float_parse(value):
+    """
+    The price the float() based feed parsers stored, after the DecimalField rounded it to cents.
+    """
+    field = models.DecimalField(max_digits=6, decimal_places=2)
+    return Decimal(format_number(field.to_python(float(value or '0')), 6, 2))
+
+
+class ParsePriceTests(SimpleTestCase):
+
+    def test_matches_float_parsing(self):
+        random.seed(42)
+        for _ in range(20_000):
+            thousandths = random.randint(0, 9_999_994)
+            units, fraction = divmod(thousandths, 1000)
+            for value in (f"{units}.{fraction:03d}", f"{units}.{fraction // 10:02d}", f"{units}.{fraction // 100}", str(units)):
+                expected = float_parse(value)
+                parsed = parse_price(value, '.')
+                if value.endswith('5') and len(value.partition('.')[2]) == 3 and units >= 1000:
+                    # An exact half cent, float() rounds it by the binary representation
+                    self.assertLessEqual(abs(parsed - expected), Decimal('0.01'), value)
+                else:
+                    self.assertEqual(parsed, expected, value)
+
+    def test_three_decimals(self):
+        self.assertEqual(parse_price('12.990', '.'), Decimal('12.99'))
+        self.assertEqual(parse_price('4.950', '.'), Decimal('4.95'))
+        self.assertEqual(parse_price('12.345', '.'), Decimal('12.34'))
+        self.assertEqual(parse_price('12,990', ','), Decimal('12.99'))
+
+    def test_ambiguous_separator_raises(self):
+        for value in ('12.990', '4.950', '12.345', '1,234'):
+            with self.assertRaises(ValueError):
+                parse_price(value)
+
+    def test_derived_separators(self):
+        self.assertEqual(parse_price('12.99'), Decimal('12.99'))
+        self.assertEqual(parse_price('12,99 EUR'), Decimal('12.99'))
+        self.assertEqual(parse_price('1.234,56'), Decimal('1234.56'))
+        self.assertEqual(parse_price('1,234.5'), Decimal('1234.50'))
+        self.assertEqual(parse_price('1.234.567'), Decimal('1234567.00'))
+        self.assertEqual(parse_price(''), Decimal('0.00'))
+
+    def test_thousands_separator(self):
+        self.assertEqual(parse_price('1.299', ',', '.'), Decimal('1299.00'))
+        self.assertEqual(parse_price('1.299,00', ',', '.'), Decimal('1299.00'))
+        self.assertEqual(parse_price('24,99', ',', '.'), Decimal('24.99'))
+        self.assertEqual(parse_price('1.234.567,5', ',', '.'), Decimal('1234567.50'))
+        with self.assertRaises(ValueError):
+            parse_price('12.99', '.', '.')
+
+    def test_declared_separator(self):
+        self.assertEqual(parse_price('€ 12.99', '.'), Decimal('12.99'))
+        self.assertEqual(parse_price('12,99', '.,'), Decimal('12.99'))
+        self.assertEqual(parse_price('12.99', '.,'), Decimal('12.99'))
+        for value, separators in (('12,99', '.'), ('1.234,56', '.'), ('1.234,56', '.,'), ('abc', '.')):
+            with self.assertRaises(ValueError):
+                parse_price(value, separators)
+
+
+def has_locale(name):
+    current = locale.setlocale(locale.LC_ALL)
+    try:
+        locale.setlocale(locale.LC_ALL, name)
+    except locale.Error:
+        return False
+    finally:
+        locale.setlocale(locale.LC_ALL, current)
+    return True
+
+
+class FormatPriceTests(SimpleTestCase):
+
+    def test_format_price(self):
+        # The format of the export: a decimal comma and no thousands separator
+        for price, expected in (
+            (Decimal('0.00'), '0,00'),
+            (Decimal('0.05'), '0,05'),
+            (Decimal('12.99'), '12,99'),
+            (Decimal('12.90'), '12,90'),
+            (Decimal('999.99'), '999,99'),
+            (Decimal('1000.00'), '1000,00'),
+            (Decimal('1234.50'), '1234,50'),
+            (Decimal('9999.99'), '9999,99'),
+            (Decimal('12345.67'), '12345,67'),
+            (Decimal('1234567.89'), '1234567,89'),
+        ):
+            self.assertEqual(format_price(price), expected)
+
+    def test_rounds_to_cents(self):
+        self.assertEqual(format_price(Decimal('1234.5')), '1234,50')
+        self.assertEqual(format_price(Decimal('12')), '12,00')
+        self.assertEqual(format_price(Decimal('12.345')), '12,34')
+        self.assertEqual(format_price(Decimal('12.355')), '12,36')
+        self.assertEqual(format_price(12.5), '12,50')
+        self.assertEqual(format_price(1500), '1500,00')
+
+
+    @skipUnless(has_locale('nl_NL.UTF-8'), 'the nl_NL.UTF-8 locale is not installed')
+    def test_matches_locale_formatting(self):
+        # The formatting the export used before, format_price must give byte-identical output
+        current = locale.setlocale(locale.LC_ALL)
+        self.addCleanup(locale.setlocale, locale.LC_ALL, current)
+        locale.setlocale(locale.LC_ALL, 'nl_NL.UTF-8')
+
+        random.seed(42)
+        prices = [Decimal(cents).scaleb(-2) for cents in (0, 5, 99_999, 100_000, 123_450, 999_999, 123_456_789)]
+        prices += [Decimal(random.randint(0, 999_999)).scaleb(-2) for _ in range(10_000)]
+        for price in prices:
+            expected = locale.currency(price, symbol=False, grouping=True).replace(' ', '')
+            self.assertEqual(format_price(price), expected, price)
+
+
+class EffectivePriceTests(TestCase):
+
+    def setUp(self):
+        self.affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.AWIN, data_source_url='https://example.com/feed.csv',
+            shipping_nl=Decimal('4.95'), free_shipping_nl=Decimal('20'))
+        game = Game.objects.create(ean=1234567890123, name='Game', description='')
+        self.offer = AffiliateGame.objects.create(
+            affiliate=self.affiliate, game=game, name='Game', description='', price=Decimal('10.00'))
+
+    def test_computed_when_saved(self):
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.effective_price_nl, Decimal('14.95'))
+        self.assertEqual(self.offer.effective_price_be, Decimal('10.00'))
+
+        self.offer.price = Decimal('25.00')
+        self.offer.save(update_fields=['price'])
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.effective_price_nl, Decimal('25.00'))
+
+    def test_shipping_change_updates_effective_prices(self):
+        self.affiliate.shipping_nl = Decimal('2.50')
+        self.affiliate.save()
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.effective_price_nl, Decimal('12.50'))
+
+    def test_update_fields_without_shipping(self):
+        with self.assertNumQueries(1):
+            self.affiliate.name = 'Renamed'
+            self.affiliate.save(update_fields=['name'])
+
+        self.affiliate.free_shipping_nl = Decimal('10')
+        self.affiliate.save(update_fields=['free_shipping_nl'])
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.effective_price_nl, Decimal('10.00'))
+
+
+class SyncJobTests(TestCase):
+
+    def setUp(self):
+        self.affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.AWIN, data_source_url='https://example.com/feed.csv')
+        self.batch = create_batch(use_sample_data=True)
+
+    def test_claim_job(self):
+        job = claim_job('worker-1')
+        self.assertEqual(job.affiliate, self.affiliate)
+        self.assertEqual(job.status, SyncJob.Status.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.lease_owner, 'worker-1')
+        self.assertIsNone(claim_job('worker-2'))
+
+    def test_claim_expired_lease(self):
+        job = claim_job('worker-1')
+        SyncJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = claim_job('worker-2')
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+        self.assertFalse(heartbeat(job))
+        self.assertTrue(heartbeat(reclaimed))
+
+    def test_claim_released_job(self):
+        job = claim_job('worker-1')
+        SyncJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        def release_after_select(candidates, released=[]):
+            # The owner releases the job for a retry later, after worker-2 selected it as an expired job
+            candidates = list(candidates)
+            if not released:
+                released.append(fail_job(job, 'Error', retry_delay=60))
+            return candidates
+
+        with mock.patch('games.sync_jobs.list', side_effect=release_after_select, create=True):
+            self.assertIsNone(claim_job('worker-2'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.lease_owner), (SyncJob.Status.PENDING, 1, ''))
+
+    def test_worker_rejects_async(self):
+        with self.assertRaises(CommandError):
+            call_command('sync_worker', '--async', stdout=StringIO())
+
+    def test_heartbeat_extends_lease(self):
+        job = claim_job('worker-1', lease_seconds=10)
+        self.assertTrue(heartbeat(job, lease_seconds=300))
+        job.refresh_from_db()
+        self.assertGreater(job.lease_expires_at, timezone.now() + timedelta(seconds=200))
+
+    def test_fail_job_retries(self):
+        job = claim_job('worker-1')
+        self.assertTrue(fail_job(job, 'Error', max_attempts=2, retry_delay=0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, SyncJob.Status.PENDING)
+        self.assertEqual(job.last_error, 'Error')
+
+        job = claim_job('worker-1', max_attempts=2)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(fail_job(job, 'Error again', max_attempts=2))
+        job.refresh_from_db()
+        self.assertEqual(job.status, SyncJob.Status.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_job('worker-1', max_attempts=2))
+
+
+@override_settings(EXPORT_TOKEN='secret')
+class WordPressExportViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.AWIN, data_source_url='https://example.com/feed.csv')
+        game = Game.objects.create(ean=1234567890123, name='Game', description='')
+        AffiliateGame.objects.create(
+            affiliate=self.affiliate, game=game, name='Game', description='', price=Decimal('10.00'), stock=1)
+
+    def get(self, url_name, **headers):
+        return self.client.get(reverse(url_name), HTTP_AUTHORIZATION='Bearer secret', **headers)
+
+    def test_conditional_get(self):
+        response = self.get('wordpress_export_csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Shop', b''.join(response.streaming_content))
+
+        response = self.get('wordpress_export_csv', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_head(self):
+        response = self.client.head(reverse('wordpress_export_json'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        response = self.client.post(reverse('wordpress_export_json'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 405)
+
+    def test_requires_token_or_staff(self):
+        self.assertEqual(self.client.get(reverse('wordpress_export_csv')).status_code, 403)
+        response = self.client.get(reverse('wordpress_export_csv'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+        user = User.objects.create_user('editor', password='password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('wordpress_export_csv')).status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(reverse('wordpress_export_csv')).status_code, 200)
+
+    @override_settings(EXPORT_TOKEN='')
+    def test_no_token_configured(self):
+        self.assertEqual(self.get('wordpress_export_csv').status_code, 403)
+
+    def test_etag_computed_once(self):
+        b''.join(self.get('wordpress_export_csv').streaming_content)
+        # Only the etag queries, the cached export is streamed without queries
+        with self.assertNumQueries(4):
+            b''.join(self.get('wordpress_export_csv').streaming_content)
+
+    def test_rendered_once_while_another_request_renders(self):
+        etag = export_etag()
+        cache.add(f'wordpress_export:csv-{etag}:rendering', True)
+
+        def finish_rendering(seconds):
+            cache.set(f'wordpress_export:csv-{etag}', b'rendered elsewhere')
+
+        with mock.patch('games.views.time.sleep', side_effect=finish_rendering), \
+                mock.patch('games.views.render_export') as render_export:
+            response = self.get('wordpress_export_csv')
+            self.assertEqual(b''.join(response.streaming_content), b'rendered elsewhere')
+        render_export.assert_not_called()
+
+    def test_etag_changes_on_rename(self):
+        etag = export_etag()
+        self.affiliate.name = 'Renamed shop'
+        self.affiliate.save(update_fields=['name'])
+        self.assertNotEqual(export_etag(), etag)
+
+
+class CheckSyncRegressionsTests(TestCase):
+
+    def test_invalid_threshold(self):
+        for threshold in ('0', '1', '-0.5', '2'):
+            with self.assertRaisesMessage(CommandError, '--threshold must be between 0 and 1'):
+                call_command('check_sync_regressions', '--threshold', threshold)
+
+
+ADTRACTION_HEADER = '"Ean","Price","Instock","Description","Category","ImageUrl","TrackingUrl"'
+
+
+def adtraction_feed(*offers):
+    """
+    Returns an Adtraction feed with a row per (ean, price) tuple.
+    """
+    lines = [ADTRACTION_HEADER] + [
+        f'"{ean}","{price}","yes","Description {ean}","Spellen","https://example.com/{ean}.jpg",'
+        f'"https://example.com/{ean}"'
+        for ean, price in offers
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+class FeedTestMixin:
+    """
+    Runs update_prices on feeds written to a temporary directory, as the sample data of the affiliates.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.feeds = {}
+
+        patcher = mock.patch(
+            'games.management.commands.affiliate_command_base.get_sample_data_path', self.feeds.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        settings_override = override_settings(FEED_CACHE_DIR=os.path.join(self.tmp_dir, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def set_feed(self, affiliate, content):
+        path = os.path.join(self.tmp_dir, f'{affiliate.name}.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.feeds[affiliate.name] = path
+
+    def update_prices(self, *args):
+        stdout = StringIO()
+        call_command('update_prices', '--use_sample_data', *args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+
+class FeedTestCase(FeedTestMixin, TestCase):
+    pass
+
+
+class UpdatePricesTests(FeedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.ADTRACTION, data_source_url='https://example.com/feed.csv')
+        for ean in (1001, 1002, 1003):
+            Game.objects.create(ean=ean, name=f'Game {ean}', description='')
+        self.set_feed(self.affiliate, adtraction_feed((1001, '10.00'), (1002, '20.00')))
+        self.update_prices('--no_cache')
+
+    def offers(self):
+        return dict(AffiliateGame.objects.values_list('game_id', 'stock'))
+
+    def latest_stat(self):
+        return AffiliateSyncStat.objects.filter(affiliate=self.affiliate).latest('pk')
+
+    def test_creates_offers(self):
+        self.assertEqual(self.offers(), {1001: 1, 1002: 1})
+        self.assertEqual(AffiliateGame.objects.get(game_id=1002).price, Decimal('20.00'))
+        self.assertEqual(self.latest_stat().rows_created, 2)
+
+    def test_stale_offers_zero(self):
+        self.set_feed(self.affiliate, adtraction_feed((1001, '11.00')))
+        self.update_prices('--no_cache')
+        self.assertEqual(self.offers(), {1001: 1, 1002: 0})
+        self.assertEqual(self.latest_stat().rows_expired, 1)
+        self.assertEqual(self.latest_stat().rows_changed, 1)
+
+    def test_stale_offers_delete(self):
+        self.set_feed(self.affiliate, adtraction_feed((1001, '10.00')))
+        self.update_prices('--no_cache', '--stale_offers', 'delete')
+        self.assertEqual(self.offers(), {1001: 1})
+        self.assertEqual(self.latest_stat().rows_expired, 1)
+        self.assertEqual(self.latest_stat().rows_unchanged, 1)
+
+    def test_stale_offers_keep(self):
+        self.set_feed(self.affiliate, adtraction_feed((1001, '10.00')))
+        self.update_prices('--no_cache', '--stale_offers', 'keep')
+        self.assertEqual(self.offers(), {1001: 1, 1002: 1})
+        self.assertEqual(self.latest_stat().rows_expired, 0)
+
+    def test_no_feed_expires_nothing(self):
+        del self.feeds[self.affiliate.name]
+        self.update_prices('--no_cache', '--stale_offers', 'delete')
+        self.assertEqual(self.offers(), {1001: 1, 1002: 1})
+        self.assertEqual(self.latest_stat().rows_expired, 0)
+
+    def test_feed_without_catalogue_games_expires_nothing(self):
+        self.set_feed(self.affiliate, adtraction_feed((9999, '10.00')))
+        self.update_prices('--no_cache', '--stale_offers', 'delete')
+        self.assertEqual(self.offers(), {1001: 1, 1002: 1})
+        self.assertEqual(self.latest_stat().rows_expired, 0)
+
+
+class PriceStatsTests(TestCase):
+
+    def setUp(self):
+        self.affiliates = [
+            Affiliate.objects.create(
+                name=f'Shop {index}', program=Affiliate.Program.AWIN, data_source_url='https://example.com/feed.csv')
+            for index in range(4)
+        ]
+        self.game = Game.objects.create(ean=1001, name='Game', description='')
+
+    def set_offers(self, *prices, game=None):
+        for affiliate, price in zip(self.affiliates, prices):
+            AffiliateGame.objects.update_or_create(
+                affiliate=affiliate, game=game or self.game,
+                defaults={'name': 'Game', 'description': '', 'price': Decimal(price), 'stock': 1})
+
+    def stats(self):
+        return GamePriceStats.objects.get(game=self.game)
+
+    def test_odd_offer_count(self):
+        self.set_offers('40.00', '10.00', '20.00')
+        self.assertEqual(update_price_stats(), (1, 0, 0))
+        stats = self.stats()
+        self.assertEqual(stats.offer_count, 3)
+        self.assertEqual((stats.lowest_price, stats.median_price, stats.highest_price),
+                         (Decimal('10.00'), Decimal('20.00'), Decimal('40.00')))
+        self.assertEqual(stats.discount, Decimal('50.0'))
+        self.assertTrue(stats.is_deal)
+
+    def test_even_offer_count(self):
+        self.set_offers('10.00', '20.00', '30.00', '40.01')
+        update_price_stats()
+        stats = self.stats()
+        # The mean of the middle prices, rounded to cents
+        self.assertEqual(stats.median_price, Decimal('25.00'))
+        self.assertEqual(stats.discount, Decimal('60.0'))
+
+    def test_deal_at_min_discount(self):
+        self.set_offers('85.00', '100.00', '100.00')
+        update_price_stats()
+        self.assertEqual(self.stats().discount, Decimal('15.0'))
+        self.assertTrue(self.stats().is_deal)
+
+        self.set_offers('85.10', '100.00', '100.00')
+        update_price_stats()
+        self.assertEqual(self.stats().discount, Decimal('14.9'))
+        self.assertFalse(self.stats().is_deal)
+
+    def test_single_offer_is_no_deal(self):
+        self.set_offers('10.00')
+        update_price_stats(min_discount=Decimal('0'))
+        self.assertFalse(self.stats().is_deal)
+
+    def test_price_drop_stays_flagged(self):
+        Game.objects.filter(pk=self.game.pk).update(last_lowest_price=Decimal('20.00'))
+        self.set_offers('15.00', '20.00')
+        update_price_stats()
+        self.assertTrue(self.stats().is_price_drop)
+
+        # The export stores the new lowest price, the drop stays flagged until the lowest price changes
+        update_last_lowest_prices()
+        self.assertEqual(update_price_stats(), (0, 0, 0))
+        self.assertTrue(self.stats().is_price_drop)
+
+        self.set_offers('16.00', '20.00')
+        update_price_stats()
+        self.assertFalse(self.stats().is_price_drop)
+
+    def test_deletes_stats_without_offers_in_stock(self):
+        self.set_offers('10.00', '20.00')
+        update_price_stats()
+        AffiliateGame.objects.update(stock=0)
+        self.assertEqual(update_price_stats(), (0, 0, 1))
+        self.assertFalse(GamePriceStats.objects.exists())
+
+
+class ImportSpelvindenTests(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        os.makedirs(os.path.join(self.base_dir, 'games', 'sample_data'))
+        Game.objects.create(ean=1001, name='Game', description='')
+
+    def import_games(self, *prices):
+        with open(os.path.join(self.base_dir, 'games', 'sample_data', 'Spelvinden.csv'), 'w', encoding='utf-8') as f:
+            f.write('SKU,Name,Description,Regular price\n')
+            for index, price in enumerate(prices):
+                f.write(f'{2001 + index},Game {index},Description,"{price}"\n')
+        with override_settings(BASE_DIR=self.base_dir):
+            call_command('import_spelvinden', '--use_sample_data', stdout=StringIO())
+
+    def test_dutch_prices(self):
+        self.import_games('1.299', '1.299,00', '24,99')
+        self.assertEqual(list(Game.objects.order_by('ean').values_list('ean', 'last_lowest_price')), [
+            (2001, Decimal('1299.00')), (2002, Decimal('1299.00')), (2003, Decimal('24.99')),
+        ])
+
+    def test_invalid_price_keeps_games(self):
+        with self.assertRaises(ValueError):
+            self.import_games('24,99', 'gratis')
+        self.assertEqual(list(Game.objects.values_list('ean', flat=True)), [1001])
+
+
+class FeedCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = FeedCache(self.cache_dir, max_size=1024 * 1024)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def test_key(self):
+        key = self.cache.make_key(b'feed', 'Awin:5', hash_game_eans({1, 2}))
+        self.cache.set(key, [(1, 'a')])
+        self.assertEqual(self.cache.get(key), [(1, 'a')])
+        self.assertEqual(self.cache.get(self.cache.make_key(b'feed', 'Awin:5', hash_game_eans([2, 1]))), [(1, 'a')])
+
+        self.assertIsNone(self.cache.get(self.cache.make_key(b'feed', 'Awin:6', hash_game_eans({1, 2}))))
+        self.assertIsNone(self.cache.get(self.cache.make_key(b'feed', 'Awin:5', hash_game_eans({1, 3}))))
+        self.assertIsNone(self.cache.get(self.cache.make_key(b'other feed', 'Awin:5', hash_game_eans({1, 2}))))
+
+    def test_format_version_mismatch(self):
+        with open(self.entry_path('old'), 'wb') as f:
+            pickle.dump((CACHE_FORMAT_VERSION - 1, [(1, 'a')]), f)
+        self.assertIsNone(self.cache.get('old'))
+        self.assertFalse(os.path.exists(self.entry_path('old')))
+
+    def test_corrupt_entry(self):
+        with open(self.entry_path('corrupt'), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertIsNone(self.cache.get('corrupt'))
+        self.assertFalse(os.path.exists(self.entry_path('corrupt')))
+
+    def test_evicts_least_recently_used(self):
+        rows = [(ean, 'x' * 100) for ean in range(10)]
+        for age, key in enumerate(('a', 'b', 'c')):
+            self.cache.set(key, rows)
+            # Older entries have an older access time
+            os.utime(self.entry_path(key), (1000 + age, 1000 + age))
+
+        # Room for three entries, reading 'a' makes 'b' the least recently used
+        self.cache.max_size = os.path.getsize(self.entry_path('a')) * 3
+        self.assertIsNotNone(self.cache.get('a'))
+        self.cache.set('d', rows)
+
+        self.assertEqual(sorted(name[0] for name in os.listdir(self.cache_dir)), ['a', 'c', 'd'])
+
+
+class FeedCacheCommandTests(FeedTestCase):
+
+    def test_second_run_uses_cache(self):
+        affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.ADTRACTION, data_source_url='https://example.com/feed.csv')
+        Game.objects.create(ean=1001, name='Game', description='')
+        self.set_feed(affiliate, adtraction_feed((1001, '10.00')))
+
+        self.update_prices()
+        self.update_prices()
+        self.update_prices('--no_cache')
+
+        stats = AffiliateSyncStat.objects.filter(affiliate=affiliate).order_by('pk')
+        self.assertEqual([stat.from_cache for stat in stats], [False, True, False])
+        self.assertEqual([stat.rows_matched for stat in stats], [1, 1, 1])
+
+
+class FeedReaderTests(SimpleTestCase):
+
+    def lines(self, content):
+        return list(iter_feed_lines(content))
+
+    def test_line_endings(self):
+        self.assertEqual(self.lines(b'a;b\nc;d\n'), ['a;b', 'c;d'])
+        self.assertEqual(self.lines(b'a;b\r\nc;d\r\n'), ['a;b', 'c;d'])
+        self.assertEqual(self.lines(b'a;b\rc;d\r'), ['a;b', 'c;d'])
+        self.assertEqual(self.lines(b'a;b\nc;d'), ['a;b', 'c;d'])
+        self.assertEqual(self.lines(b''), [])
+
+    def test_skips_byte_order_mark(self):
+        self.assertEqual(self.lines(b'\xef\xbb\xbfean;price\n1;2\n'), ['ean;price', '1;2'])
+        self.assertEqual(sniff_feed_delimiter(b'\xef\xbb\xbfean;price\n1;2\n'), ';')
+
+    def test_keeps_unicode_separators(self):
+        # str.splitlines() would split on these, they're part of descriptions
+        content = 'ean;description\n1;line\u2028separator\x85next\x0cpage\n'.encode()
+        self.assertEqual(self.lines(content), ['ean;description', '1;line\u2028separator\x85next\x0cpage'])
+
+    def test_sniffs_first_page(self):
+        content = b'ean;price;name\n' + b'1;2;a\n' * (SNIFF_SIZE // 6) + b'1,2,3,4,5,6,7\n' * 1000
+        self.assertEqual(sniff_feed_delimiter(content), ';')
+
+    def test_sniffs_long_first_line(self):
+        header = ';'.join(f'column{index}' for index in range(SNIFF_SIZE // 8))
+        self.assertGreater(len(header), SNIFF_SIZE)
+        self.assertEqual(sniff_feed_delimiter(header.encode() + b'\n1;2\n'), ';')
+        self.assertEqual(sniff_feed_delimiter(header.encode()), ';')
+
+    def test_map_feed_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        empty_path = os.path.join(tmp_dir, 'empty.csv')
+        open(empty_path, 'wb').close()
+        self.assertEqual(map_feed_file(empty_path), b'')
+
+        path = os.path.join(tmp_dir, 'feed.csv')
+        with open(path, 'wb') as f:
+            f.write(b'ean;price\r\n1;2\r\n')
+        content = map_feed_file(path)
+        self.assertEqual(self.lines(content), ['ean;price', '1;2'])
+        content.close()
+
+
+class ColumnTests(SimpleTestCase):
+
+    def test_missing_column(self):
+        self.assertEqual(Column('Price', cast=parse_price).compile({'ean': 0})(['1']), Decimal('0.00'))
+        self.assertEqual(Column('Description').compile({'ean': 0})(['1']), '')
+
+    def test_first_non_empty_column(self):
+        get_ean = Column('EAN', 'GTIN', cast=parse_ean).compile({'EAN': 0, 'GTIN': 1})
+        self.assertEqual(get_ean(['1001', '2002']), 1001)
+        self.assertEqual(get_ean(['', '2002']), 2002)
+        self.assertEqual(get_ean(['', '']), 0)
+
+    def test_single_column(self):
+        self.assertEqual(Column('EAN', 'GTIN').compile({'GTIN': 1})(['x', '2002']), '2002')
+
+
+class FeedParserTests(SimpleTestCase):
+
+    parser = FeedParser(
+        ean=Column('ean', cast=parse_ean),
+        price=Column('price', cast=parse_price),
+        stock=Column('stock', cast=parse_int),
+        description=Column('description'),
+        category=Column('category'),
+        image=Column('image'),
+        link=Column('link'),
+    )
+
+    def test_missing_field(self):
+        with self.assertRaisesMessage(ValueError, 'Missing columns for image, link'):
+            FeedParser(**{field: Column(field) for field in ('ean', 'price', 'stock', 'description', 'category')})
+
+    def test_short_rows_are_padded(self):
+        rows = [['ean', 'price', 'stock', 'description', 'link'], ['1001', '12.99', '3'], ['1002']]
+        self.assertEqual(self.parser.parse_rows(rows), [
+            (1001, Decimal('12.99'), 3, '', '', '', ''),
+            (1002, Decimal('0.00'), 0, '', '', '', ''),
+        ])
+
+    def test_filters_game_eans(self):
+        rows = [['ean', 'price', 'stock'], ['1001', '1.00', '1'], ['', '2.00', '1'], ['1003', '3.00', '1']]
+        self.assertEqual([game.ean for game in self.parser.parse_rows(rows)], [1001, 1003])
+        self.assertEqual([game.ean for game in self.parser.parse_rows(rows, {1003})], [1003])
+        self.assertEqual(self.parser.parse_rows([]), [])
+
+
+# The row parsers the FeedParser mappings replaced, prices are compared as stored by a DecimalField
+OLD_PARSERS = {
+    Affiliate.Program.ADTRACTION: lambda row: (
+        int(row.get('Ean', 0) or 0),
+        float_parse(row.get('Price', 0) or '0'),
+        1 if row.get('Instock') == 'yes' else 0,
+        row.get('Description'),
+        row.get('Category', ''),
+        row.get('ImageUrl', ''),
+        row.get('TrackingUrl'),
+    ),
+    Affiliate.Program.TRADETRACKER: lambda row: (
+        int(row.get('EAN') or row.get('GTIN') or 0),
+        float_parse(row.get('price', 0) or '0'),
+        1 if row.get('availability', '').lower() == 'op voorraad' else 0,
+        row.get('description'),
+        row.get('categories', ''),
+        row.get('imageURL', ''),
+        row.get('productURL', ''),
+    ),
+    Affiliate.Program.AWIN: lambda row: (
+        int(row.get('ean') or 0),
+        float_parse((row.get('store_price') or '0').replace(',', '.')),
+        int(row.get('stock_quantity') or '0'),
+        row.get('description'),
+        row.get('merchant_category', ''),
+        row.get('merchant_image_url', ''),
+        row.get('aw_deep_link', ''),
+    ),
+    Affiliate.Program.DAISYCON: lambda row: (
+        int(row.get('ean') or 0),
+        float_parse(row.get('price', 0) or '0'),
+        int(row.get('in_stock_amount', 0) or '0') > 0,
+        row.get('description'),
+        row.get('category', ''),
+        row.get('image_default', ''),
+        row.get('link', ''),
+    ),
+}
+
+PROGRAM_FEEDS = {
+    Affiliate.Program.ADTRACTION: """\
+"SKU","Name","Description","Category","Price","Instock","ImageUrl","TrackingUrl","Ean"
+"a1","Catan","Ruilen en bouwen","Bordspellen","34.99","yes","https://example.com/1.jpg","https://example.com/1","1001"
+"a2","Carcassonne","Tegels leggen","Bordspellen","24.990","no","https://example.com/2.jpg","https://example.com/2","1002"
+"a3","Dixit","","Kaartspellen","19","yes","","https://example.com/3","1003"
+"a4","Zonder EAN","","","9.99","yes","","https://example.com/4",""
+"a5","Niet in catalogus","","","9.99","yes","","https://example.com/5","9999"
+""",
+    Affiliate.Program.TRADETRACKER: """\
+"ID";"name";"description";"categories";"price";"availability";"imageURL";"productURL";"EAN";"GTIN"
+"t1";"Catan";"Ruilen en bouwen";"Bordspellen";"34.99";"Op voorraad";"https://example.com/1.jpg";"https://example.com/1";"1001";""
+"t2";"Carcassonne";"Tegels leggen";"Bordspellen";"24.5";"Niet op voorraad";"";"https://example.com/2";"";"1002"
+"t3";"Dixit";"";"Kaartspellen";"";"op voorraad";"";"https://example.com/3";"1003";"2003"
+"t4";"Zonder EAN";"";"";"9.99";"Op voorraad";"";"https://example.com/4";"";""
+""",
+    Affiliate.Program.AWIN: """\
+aw_product_id,product_name,description,merchant_category,store_price,stock_quantity,merchant_image_url,aw_deep_link,ean
+w1,Catan,Ruilen en bouwen,Bordspellen,"34,99",5,https://example.com/1.jpg,https://example.com/1,1001
+w2,Carcassonne,Tegels leggen,Bordspellen,24.99,0,,https://example.com/2,1002
+w3,Dixit,,Kaartspellen,19.995,,,https://example.com/3,1003
+w4,Niet in catalogus,,,9.99,1,,https://example.com/4,9999
+""",
+    Affiliate.Program.DAISYCON: """\
+title|description|category|price|in_stock_amount|image_default|link|ean
+Catan|Ruilen en bouwen|Bordspellen|34.99|3|https://example.com/1.jpg|https://example.com/1|1001
+Carcassonne|Tegels leggen|Bordspellen|24.99|0||https://example.com/2|1002
+Dixit||Kaartspellen|12.345|||https://example.com/3|1003
+Zonder EAN|||9.99|1||https://example.com/4|
+""",
+}
+
+
+class AffiliateParserEquivalenceTests(SimpleTestCase):
+    """
+    The FeedParser of every program gives the same result as the row parser it replaced.
+    """
+    game_eans = {1001, 1002, 1003}
+
+    def assert_same_as_old_parser(self, program):
+        lines = PROGRAM_FEEDS[program].splitlines()
+        delimiter = csv.Sniffer().sniff('\n'.join(lines[:10])).delimiter
+
+        expected = []
+        for row in csv.DictReader(lines, delimiter=delimiter):
+            game = OLD_PARSERS[program](row)
+            if game[0] and game[0] in self.game_eans:
+                expected.append(game)
+
+        parsed = AFFILIATE_PARSERS[program].parse_rows(csv.reader(lines, delimiter=delimiter), self.game_eans)
+        self.assertEqual([tuple(game) for game in parsed], expected)
+        self.assertEqual([game.ean for game in parsed], [1001, 1002, 1003])
+
+    def test_adtraction(self):
+        self.assert_same_as_old_parser(Affiliate.Program.ADTRACTION)
+
+    def test_tradetracker(self):
+        self.assert_same_as_old_parser(Affiliate.Program.TRADETRACKER)
+
+    def test_awin(self):
+        self.assert_same_as_old_parser(Affiliate.Program.AWIN)
+
+    def test_daisycon(self):
+        self.assert_same_as_old_parser(Affiliate.Program.DAISYCON)
+
+    def test_every_program(self):
+        self.assertEqual(set(AFFILIATE_PARSERS), set(OLD_PARSERS))
+
+
+class ShardedExportTests(TransactionTestCase):
+    # The shards are written by threads with their own database connection, which only see committed data
+
+    def setUp(self):
+        # The command writes to the exports directory in the working directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp_dir)
+
+        affiliate = Affiliate.objects.create(
+            name='Shop', program=Affiliate.Program.AWIN, data_source_url='https://example.com/feed.csv')
+        categories = [AffiliateCategory.objects.create(affiliate=affiliate, name=name) for name in ('Bordspellen', 'Kaartspellen')]
+        for index in range(11):
+            game = Game.objects.create(ean=8710000000000 + index, name=f'Game {index}', description='')
+            if index < 8:
+                AffiliateGame.objects.create(
+                    affiliate=affiliate, game=game, name=game.name, description='', price=Decimal('10.00') + index,
+                    stock=1, category=categories[index % 2])
+
+    def assert_complete(self, shard_by, *args):
+        call_command('create_wordpress_import_csv', '--shard_by', shard_by, *args, stdout=StringIO())
+        exports_dir = os.path.join(self.tmp_dir, 'exports')
+        export_name, = os.listdir(exports_dir)
+        export_dir = os.path.join(exports_dir, export_name)
+        with open(os.path.join(export_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        eans = []
+        for shard in manifest['shards']:
+            path = os.path.join(export_dir, shard['file'])
+            with open(path, 'rb') as f:
+                self.assertEqual(hashlib.sha256(f.read()).hexdigest(), shard['sha256'])
+            with open(path, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))[1:]
+            self.assertEqual(len(rows), shard['rows'])
+            eans += [int(row[0]) for row in rows]
+
+        self.assertEqual(manifest['shard_by'], shard_by)
+        self.assertEqual(manifest['total_rows'], sum(shard['rows'] for shard in manifest['shards']))
+        self.assertEqual(sorted(eans), list(Game.objects.order_by('ean').values_list('ean', flat=True)))
+        shutil.rmtree(exports_dir)
+        return manifest
+
+    def test_shard_by_ean(self):
+        manifest = self.assert_complete('ean', '--shards', '3')
+        self.assertEqual([shard['key'] for shard in manifest['shards']], ['0', '1', '2'])
+
+    def test_shard_by_rows(self):
+        manifest = self.assert_complete('rows', '--shards', '4')
+        self.assertEqual([shard['rows'] for shard in manifest['shards']], [3, 3, 3, 2])
+
+    def test_shard_by_category(self):
+        manifest = self.assert_complete('category')
+        self.assertEqual({shard['key']: shard['rows'] for shard in manifest['shards']},
+                         {'Bordspellen': 4, 'Kaartspellen': 4, 'none': 3})
+
+    def test_invalid_options(self):
+        for args in (['--shard_by', 'ean', '--shards', '0'], ['--shard_by', 'rows', '--shards', '-1'],
+                     ['--shard_by', 'category', '--shards', '2'], ['--shards', '2'],
+                     ['--chunk_size', '0'], ['--shard_by', 'rows', '--chunk_size', '-5']):
+            with self.assertRaises(CommandError):
+                call_command('create_wordpress_import_csv', *args, stdout=StringIO())
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'exports')))
+
+
+class AsyncPipelineTests(FeedTestMixin, TransactionTestCase):
+    # The writers store the results from threads with their own database connection
+
+    FEEDS = {
+        'Shop 1': adtraction_feed((1001, '10.00'), (1002, '20.00'), (1003, '30.00'), (9999, '1.00')),
+        'Shop 2': adtraction_feed((1002, '19.00'), (1004, '40.00'), (1004, '41.00')),
+        'Shop 3': adtraction_feed((9999, '1.00')),
+        'Shop 4': None,
+        'Shop 5': adtraction_feed(*[(ean, f'{ean - 1000}.50') for ean in range(1001, 1011)]),
+    }
+
+    # Feeds of an earlier sync, so the sync adds, changes, keeps and expires offers
+    PREVIOUS_FEEDS = {
+        'Shop 1': adtraction_feed((1001, '9.00'), (1002, '20.00'), (1005, '5.00')),
+        'Shop 5': adtraction_feed((1001, '1.50'), (1002, '3.00')),
+    }
+
+    def setUp(self):
+        super().setUp()
+        for ean in range(1001, 1011):
+            Game.objects.create(ean=ean, name=f'Game {ean}', description='')
+        for name in self.FEEDS:
+            Affiliate.objects.create(
+                name=name, program=Affiliate.Program.ADTRACTION, data_source_url='https://example.com/feed.csv')
+
+    def use_feeds(self, feeds):
+        self.feeds.clear()
+        for name, content in feeds.items():
+            if content:
+                self.set_feed(Affiliate.objects.get(name=name), content)
+
+    def sync(self, *args):
+        """
+        Syncs the feeds after a sync of the previous feeds, returns the reported total, the offers and the statistics.
+        """
+        AffiliateGame.objects.all().delete()
+        self.use_feeds(self.PREVIOUS_FEEDS)
+        self.update_prices('--no_cache')
+        AffiliateSyncStat.objects.all().delete()
+
+        self.use_feeds(self.FEEDS)
+        output = self.update_prices('--no_cache', *args)
+        total = [line for line in output.splitlines() if line.startswith('Completed price update')]
+        offers = sorted(AffiliateGame.objects.values_list('affiliate__name', 'game_id', 'price', 'stock'))
+        stats = sorted(AffiliateSyncStat.objects.values_list(
+            'affiliate__name', 'rows_scanned', 'rows_matched', 'rows_created', 'rows_changed', 'rows_unchanged',
+            'rows_expired', 'error'))
+        return total, offers, stats
+
+    def test_same_result_as_sequential(self):
+        sequential = self.sync()
+        self.assertEqual(len(sequential[2]), len(self.FEEDS))
+        self.assertTrue(any(stat[6] for stat in sequential[2]))
+        self.assertEqual(self.sync('--async'), sequential)
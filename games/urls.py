@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('wordpress.csv', views.wordpress_export, {'export_format': 'csv'}, name='wordpress_export_csv'),
+    path('wordpress.json', views.wordpress_export, {'export_format': 'json'}, name='wordpress_export_json'),
+]
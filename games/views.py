@@ -1,3 +1,132 @@
-from django.shortcuts import render
+import csv
+import hmac
+import json
+import time
+from functools import wraps
 
-# Create your views here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_safe
+
+from games.exports import EXPORT_HEADER, export_etag, iter_export_rows
+
+# Size of the chunks a cached export is streamed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Seconds between checks whether another request finished rendering the export
+RENDER_POLL_INTERVAL = 0.2
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so csv.writer can be used to render single rows.
+    """
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows):
+    keys = ['sku', 'name', 'price', 'in_stock', 'short_description']
+    separator = '['
+    for row in rows:
+        yield separator + json.dumps(dict(zip(keys, row)))
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+EXPORT_RENDERERS = {
+    'csv': render_csv,
+    'json': render_json,
+}
+
+
+def wordpress_export_etag(request, export_format):
+    # Computed once per request, it's needed for the conditional response and the cache key
+    if not hasattr(request, 'export_etag'):
+        request.export_etag = f'{export_format}-{export_etag()}'
+    return request.export_etag
+
+
+def stream_cached(payload):
+    for start in range(0, len(payload), STREAM_CHUNK_SIZE):
+        yield payload[start:start + STREAM_CHUNK_SIZE]
+
+
+def render_export(export_format):
+    return ''.join(EXPORT_RENDERERS[export_format](iter_export_rows(save_lowest_prices=False))).encode('utf-8')
+
+
+def get_export_payload(export_format, etag):
+    """
+    Returns the rendered export for the ETag from the cache, rendering it if it isn't cached yet.
+
+    Only one request renders the export, concurrent requests for the same ETag wait for it to be cached
+    instead of rendering the whole catalogue as well. That needs a cache shared by all processes.
+    """
+    cache_key = f'wordpress_export:{etag}'
+    lock_key = f'{cache_key}:rendering'
+    deadline = time.monotonic() + settings.EXPORT_RENDER_TIMEOUT
+    while True:
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return payload
+
+        # Render it when no other request is rendering it, or when that takes too long
+        if cache.add(lock_key, True, settings.EXPORT_RENDER_TIMEOUT) or time.monotonic() > deadline:
+            try:
+                payload = render_export(export_format)
+                cache.set(cache_key, payload, settings.EXPORT_CACHE_TIMEOUT)
+                return payload
+            finally:
+                cache.delete(lock_key)
+
+        time.sleep(RENDER_POLL_INTERVAL)
+
+
+def require_export_access(view):
+    """
+    Allows staff users and clients that pass the EXPORT_TOKEN as "Authorization: Bearer <token>".
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        has_token = bool(settings.EXPORT_TOKEN) and scheme.lower() == 'bearer' and \
+            hmac.compare_digest(token.encode(), settings.EXPORT_TOKEN.encode())
+        if not (has_token or request.user.is_staff):
+            raise PermissionDenied
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_safe
+@require_export_access
+@gzip_page
+@condition(etag_func=wordpress_export_etag)
+def wordpress_export(request, export_format):
+    """
+    Streams the WordPress export as CSV or JSON.
+
+    The ETag changes after every sync that changed the data, so clients can poll with If-None-Match
+    and get a 304 as long as nothing changed. The rendered export is cached under the same tag.
+    """
+    if request.method == 'HEAD':
+        # The body isn't sent, no need to render it
+        return StreamingHttpResponse([], content_type=EXPORT_CONTENT_TYPES[export_format])
+
+    payload = get_export_payload(export_format, wordpress_export_etag(request, export_format))
+    return StreamingHttpResponse(stream_cached(payload), content_type=EXPORT_CONTENT_TYPES[export_format])
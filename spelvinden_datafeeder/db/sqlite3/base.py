@@ -0,0 +1,17 @@
+"""
+SQLite backend that starts transactions with BEGIN IMMEDIATE.
+
+With the default deferred BEGIN a transaction that reads before it writes fails right away with
+"database is locked" when another connection is writing, instead of waiting for the lock. This
+happens with concurrent sync workers, e.g. in update_or_create. Taking the write lock at the start
+of the transaction makes SQLite wait up to the 'timeout' option instead.
+
+Django 5.1 supports this with the 'transaction_mode' option, this backend can be removed then.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,8 +79,12 @@ WSGI_APPLICATION = 'spelvinden_datafeeder.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'spelvinden_datafeeder.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds to wait for a lock, so concurrent sync workers don't fail with "database is locked"
+            'timeout': 20,
+        },
     }
 }
 
@@ -124,3 +129,21 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache of parsed affiliate feeds, see games/management/commands/affiliate_feed_cache.py
+
+FEED_CACHE_DIR = BASE_DIR / 'cache' / 'feeds'
+FEED_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+
+# Number of seconds a rendered WordPress export is kept in the cache, see games/views.py
+
+EXPORT_CACHE_TIMEOUT = 60 * 60
+
+# Seconds other requests wait for the request that renders the export, before rendering it themselves
+EXPORT_RENDER_TIMEOUT = 60
+
+# Shared secret clients pass as "Authorization: Bearer <token>" to fetch the export, staff users can
+# fetch it when logged in to the admin. Without a token only staff users can fetch it.
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN', '')